@@ -0,0 +1,35 @@
+#! /usr/bin/env python3
+from typing import *
+
+
+def adaptive_scan(
+    count_samples: Callable[[List[int]], List[int]], num_samples: int, coarse_step=4
+) -> Tuple[List[int], int]:
+    """
+    Face count of every sample (second) 0..num_samples-1 from far fewer detector calls than a dense scan.
+    Every `coarse_step`-th sample is counted first; wherever two neighbouring known samples disagree the
+    sample halfway between them is counted next, until every change is pinned to two adjacent samples.
+    Stretches between agreeing samples take their count. A shot shorter than `coarse_step` enclosed by
+    equal counts can be missed, so keep `coarse_step` well below the minimum run length that matters.
+
+    :param count_samples: Returns the face counts of the given (increasing) sample indices
+    :return: The counts of all samples, and how many samples were actually counted
+    """
+    if num_samples <= 0:
+        return [], 0
+    known: Dict[int, int] = {}
+    todo = sorted(set(range(0, num_samples, coarse_step)) | {num_samples - 1})
+    num_counted = 0
+    while todo:
+        known.update(zip(todo, count_samples(todo)))
+        num_counted += len(todo)
+        points = sorted(known)
+        todo = [(a + b) // 2 for a, b in zip(points, points[1:]) if b - a > 1 and known[a] != known[b]]
+
+    markers = [0] * num_samples
+    points = sorted(known)
+    for a, b in zip(points, points[1:]):
+        # neighbours either agree, or are adjacent samples: either way [a, b) has a's count
+        markers[a:b] = [known[a]] * (b - a)
+    markers[points[-1]] = known[points[-1]]
+    return markers, num_counted
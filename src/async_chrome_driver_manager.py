@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import *
+
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
+from selenium.webdriver.remote.webelement import WebElement
+
+from chrome_driver_manager import ChromeDriverManager
+
+
+class AsyncChromeDriverManager:
+    """
+    Awaitable facade over a `ChromeDriverManager`.
+    Every selenium call runs on a single thread dedicated to this driver (webdriver sessions are not
+    thread safe), so the event loop stays free and several drivers can be used concurrently.
+    """
+
+    ignored_exceptions = (NoSuchElementException, StaleElementReferenceException)
+
+    def __init__(self, cdm: ChromeDriverManager):
+        self.cdm = cdm
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="chrome-driver")
+
+    @classmethod
+    async def create(cls, **cdm_kwargs) -> "AsyncChromeDriverManager":
+        loop = asyncio.get_running_loop()
+        cdm = await loop.run_in_executor(None, partial(ChromeDriverManager, **cdm_kwargs))
+        return cls(cdm)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking call on this driver's thread and await its result."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def open_url(self, pageUrl: str) -> None:
+        await self.run(self.cdm.open_url, pageUrl)
+
+    async def current_url(self) -> str:
+        return await self.run(lambda: self.cdm.driver.current_url)
+
+    async def find_element(self, by: str, value: str) -> WebElement:
+        return await self.run(self.cdm.driver.find_element, by, value)
+
+    async def find_elements(self, by: str, value: str) -> List[WebElement]:
+        return await self.run(self.cdm.driver.find_elements, by, value)
+
+    async def execute_script(self, script: str, *args) -> Any:
+        return await self.run(self.cdm.driver.execute_script, script, *args)
+
+    async def send_keys(self, element: WebElement, *keys) -> None:
+        await self.run(element.send_keys, *keys)
+
+    async def get_attribute(self, element: WebElement, name: str) -> Optional[str]:
+        return await self.run(element.get_attribute, name)
+
+    async def location(self, element: WebElement) -> Dict[str, int]:
+        return await self.run(lambda: element.location)
+
+    async def wait_until(
+        self, condition: Callable, timeout=10.0, poll_interval=0.05, max_poll_interval=1.0, backoff=1.5
+    ) -> Any:
+        """
+        Await until `condition(driver)` returns a truthy value (same contract as selenium's expected
+        conditions) and return that value. The condition is polled with an exponentially growing
+        interval, capped at `max_poll_interval`.
+        :raises TimeoutException: if the condition is still falsy after `timeout` seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                value = await self.run(condition, self.cdm.driver)
+                if value:
+                    return value
+            except self.ignored_exceptions:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException(f"Condition not met after {timeout}s")
+            await asyncio.sleep(min(poll_interval, remaining))
+            poll_interval = min(poll_interval * backoff, max_poll_interval)
+
+    async def wait_for_url_change(self, prev_url: str, timeout=20.0, **kwargs) -> str:
+        return await self.wait_until(
+            lambda driver: driver.current_url != prev_url and driver.current_url, timeout, **kwargs
+        )
+
+    async def close(self, quit_driver=False) -> None:
+        """Release the driver thread; also quit the browser when `quit_driver` is set."""
+        if quit_driver:
+            await self.run(self.cdm.close_driver)
+        self._executor.shutdown(wait=False)
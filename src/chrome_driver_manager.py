@@ -3,6 +3,7 @@ import platform
 from typing import *
 
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
@@ -105,6 +106,13 @@ class ChromeDriverManager:
     def close_driver(self) -> None:
         self.driver.quit()
 
+    def is_alive(self) -> bool:
+        try:
+            self.driver.window_handles
+            return True
+        except WebDriverException:
+            return False
+
     def open_new_tab(self, link: str):
         self.driver.execute_script("window.open(" + link + ")")
         self.driver.switch_to.window(self.get_driver_handles()[-1])
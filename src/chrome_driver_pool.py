@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import *
+
+from selenium.common.exceptions import WebDriverException
+
+from chrome_driver_manager import ChromeDriverManager
+
+
+class ChromeDriverPool:
+    """
+    A pool of warm `ChromeDriverManager`s that concurrent jobs borrow from.
+    At most `width` browsers are alive at once; a browser is recycled after `max_uses` jobs
+    and replaced whenever it crashes.
+    """
+
+    def __init__(self, width=4, max_uses=20, max_retries=1, **cdm_kwargs):
+        """
+        :param width: Maximum number of browsers alive at the same time
+        :param max_uses: Number of jobs a browser serves before it is restarted
+        :param max_retries: Number of times a caller should retry a job on a fresh browser after a crash
+        :param cdm_kwargs: Keyword arguments forwarded to `ChromeDriverManager`
+        """
+        self.width = width
+        self.max_uses = max_uses
+        self.max_retries = max_retries
+        self.cdm_kwargs = cdm_kwargs
+
+        self._slots = threading.BoundedSemaphore(width)
+        self._async_slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._idle: List[ChromeDriverManager] = []
+        self._uses: Dict[int, int] = {}
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _new_driver(self) -> ChromeDriverManager:
+        cdm = ChromeDriverManager(**self.cdm_kwargs)
+        with self._lock:
+            self._uses[id(cdm)] = 0
+        return cdm
+
+    def _discard(self, cdm: ChromeDriverManager) -> None:
+        with self._lock:
+            self._uses.pop(id(cdm), None)
+        try:
+            cdm.close_driver()
+        except Exception:
+            pass
+
+    def start(self) -> None:
+        """Start all `width` browsers in parallel so the first jobs don't pay the cold start."""
+        with self._lock:
+            missing = self.width - len(self._idle)
+        with ThreadPoolExecutor(max(missing, 1)) as ex:
+            drivers = list(ex.map(lambda _: self._new_driver(), range(missing)))
+        with self._lock:
+            self._idle += drivers
+
+    def acquire(self) -> ChromeDriverManager:
+        if self._closed:
+            raise RuntimeError("ChromeDriverPool is closed")
+        self._slots.acquire()
+        with self._lock:
+            cdm = self._idle.pop() if self._idle else None
+        if cdm is not None and cdm.is_alive():
+            return cdm
+        if cdm is not None:
+            self._discard(cdm)
+        try:
+            return self._new_driver()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, cdm: ChromeDriverManager, broken=False) -> None:
+        with self._lock:
+            self._uses[id(cdm)] = self._uses.get(id(cdm), 0) + 1
+            worn_out = self._uses[id(cdm)] >= self.max_uses
+        if broken or worn_out or self._closed or not cdm.is_alive():
+            self._discard(cdm)
+        else:
+            with self._lock:
+                self._idle.append(cdm)
+        self._slots.release()
+
+    @contextmanager
+    def lease(self) -> Iterator[ChromeDriverManager]:
+        cdm = self.acquire()
+        broken = False
+        try:
+            yield cdm
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(cdm, broken=broken)
+
+    @asynccontextmanager
+    async def alease(self) -> AsyncIterator[ChromeDriverManager]:
+        """
+        Awaitable version of `lease`. Waiting for a free browser happens on the event loop, not in an
+        executor thread: blocked waiters would otherwise take up the default executor, which the jobs
+        holding the browsers need too (e.g. `asyncio.to_thread`), and never let go.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.width)
+        loop = asyncio.get_running_loop()
+        async with self._async_slots:
+            # a slot is free by now (unless `lease` is used at the same time), so this only starts a browser
+            cdm = await loop.run_in_executor(None, self.acquire)
+            broken = False
+            try:
+                yield cdm
+            except WebDriverException:
+                broken = True
+                raise
+            finally:
+                await loop.run_in_executor(None, partial(self.release, cdm, broken=broken))
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for cdm in idle:
+            self._discard(cdm)
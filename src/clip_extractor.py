@@ -0,0 +1,160 @@
+#! /usr/bin/env python3
+import csv
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from typing import *
+
+import av
+
+from clip_writer import ClipWriter, make_clip_writer
+from seek_index import get_seek_index
+
+
+class ClipExtractor:
+    """
+    Cuts every clip of a source video in one pass over it.
+    - "decode" mode: the source is decoded once, front to back (jumping over long gaps between clips to
+      the nearest keyframe, with the video's seek index), and each frame inside a clip is handed to
+      that clip's `ClipWriter` (`writer_backend`, see clip_writer.py). Boundaries are frame accurate, and
+      memory stays bounded by `queue_size` frames per open clip, at most `max_open_writers` clips at a time.
+    - "copy" mode: one ffmpeg stream copy through the segment muxer, split at every clip boundary.
+      Nothing is re-encoded, but cuts land on the first keyframe at or after each boundary.
+    Clips are (start frame #, end frame #) pairs with an exclusive end, written as
+    `<output_dir>/<prefix>_<start>_<end>.mp4`.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        mode="decode",
+        writer_backend="pyav",
+        codec="libx264",
+        crf: Optional[int] = 23,
+        preset: Optional[str] = "veryfast",
+        queue_size=32,
+        max_open_writers=2,
+    ):
+        self.output_dir = output_dir
+        self.mode = mode
+        self.writer_backend = writer_backend
+        self.writer_kwargs = {"codec": codec, "crf": crf, "preset": preset, "queue_size": queue_size}
+        self.max_open_writers = max_open_writers
+
+    def writer(self, path: str, fps: int, width: int, height: int) -> ClipWriter:
+        return make_clip_writer(self.writer_backend, path, fps, width, height, **self.writer_kwargs)
+
+    def output_path(self, prefix: str, start: int, end: int) -> str:
+        return f"{self.output_dir}/{prefix}_{start}_{end}.mp4"
+
+    def extract(self, video_path: str, clips: List[Tuple[int, int]], fps: int, prefix="") -> List[str]:
+        """Write every clip of `video_path` and return the paths written."""
+        if not clips:
+            return []
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.mode == "copy":
+            return self._extract_copy(video_path, sorted(clips), fps, prefix)
+        return self._extract_decode(video_path, sorted(clips), fps, prefix)
+
+    def _extract_decode(
+        self, video_path: str, clips: List[Tuple[int, int]], fps: int, prefix: str
+    ) -> List[str]:
+        index = get_seek_index(video_path) if shutil.which("ffprobe") is not None else None
+        paths = []
+        writers: Deque[ClipWriter] = deque()  # the open clip is always the last one
+        writer = None
+        errors = []
+        try:
+            with av.open(video_path) as container:
+                stream = container.streams.video[0]
+                stream.thread_type = "AUTO"
+                decoded, frame_idx = None, 0
+                for start, end in clips:
+                    if index is not None:
+                        # jump to the keyframe before the clip when that skips frames we'd decode anyway
+                        keyframe, keyframe_time = index.keyframe_before(start)
+                        if frame_idx is None or keyframe > frame_idx:
+                            container.seek(round(keyframe_time / stream.time_base), stream=stream)
+                            decoded, frame_idx = None, None
+                    if decoded is None:
+                        decoded = container.decode(stream)
+                    for frame in decoded:
+                        if frame_idx is None:  # first frame after a seek: a keyframe
+                            frame_idx = index.frame_at_keyframe_time(frame.time)
+                        frame_idx += 1
+                        if frame_idx - 1 < start:
+                            continue
+                        if writer is None:
+                            while len(writers) >= self.max_open_writers:
+                                writers.popleft().finish()
+                            path = self.output_path(prefix, start, end)
+                            writer = self.writer(path, fps, frame.width, frame.height)
+                            writers.append(writer)
+                            paths.append(path)
+                        writer.put(frame)
+                        if frame_idx >= end:
+                            break
+                    if writer is not None:
+                        writer.close()
+                        writer = None
+        except BaseException:
+            if writer is not None:  # cut short: dropped rather than finalised as a complete clip
+                writers.pop().abort()
+            raise
+        finally:
+            # the remaining writers all got their clip to the end
+            for w in writers:
+                try:
+                    w.finish()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        return paths
+
+    def _extract_copy(
+        self, video_path: str, clips: List[Tuple[int, int]], fps: int, prefix: str
+    ) -> List[str]:
+        index = get_seek_index(video_path)
+        boundaries = sorted({frame for clip in clips for frame in clip if frame > 0})
+        tmp_dir = tempfile.mkdtemp(prefix=".segments_", dir=self.output_dir)
+        try:
+            cmd = ["ffmpeg", "-v", "error", "-i", video_path, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy"]
+            cmd += ["-f", "segment", "-segment_frames", ",".join(map(str, boundaries))]
+            cmd += ["-reset_timestamps", "1"]
+            cmd += ["-segment_list", f"{tmp_dir}/segments.csv", "-segment_list_type", "csv"]
+            subprocess.run(cmd + [f"{tmp_dir}/%05d.mp4"], check=True)
+
+            # cuts land on keyframes (the first at or after each boundary, the following ones when several
+            # boundaries share a GOP), so every segment starts at a keyframe. A clip is made of the segments
+            # from the keyframe at or after its start to the one at or after its end; the others hold the
+            # footage between clips and are dropped
+            with open(f"{tmp_dir}/segments.csv", "r") as f:
+                rows = list(csv.reader(f))
+            firsts = [index.frame_at_keyframe_time(float(start_time)) for _, start_time, _ in rows]
+            ranges = list(zip([name for name, _, _ in rows], firsts, firsts[1:] + [index.num_frames]))
+            segments: Dict[Tuple[int, int], List[str]] = {}
+            for start, end in clips:
+                first, last = index.keyframe_after(start), index.keyframe_after(end)
+                names = [f"{tmp_dir}/{name}" for name, a, b in ranges if first <= a and b <= last]
+                if names:
+                    segments[(start, end)] = names
+
+            paths = {}
+            for clip, names in segments.items():
+                path = self.output_path(prefix, *clip)
+                if len(names) > 1:
+                    concat_list = f"{tmp_dir}/concat.txt"
+                    with open(concat_list, "w") as f:
+                        f.writelines(f"file '{os.path.abspath(name)}'\n" for name in names)
+                    joined = f"{tmp_dir}/joined.mp4"
+                    cmd = ["ffmpeg", "-v", "error", "-f", "concat", "-safe", "0", "-i", concat_list]
+                    subprocess.run(cmd + ["-c", "copy", joined], check=True)
+                    names = [joined]
+                os.replace(names[0], path)
+                paths[clip] = path
+            return [paths[clip] for clip in clips if clip in paths]
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,199 @@
+#! /usr/bin/env python3
+import os
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from queue import Empty, Queue
+from typing import *
+
+import av
+import numpy as np
+
+_DONE = object()
+_ABORT = object()
+
+Frame = Union[av.VideoFrame, np.ndarray]
+
+
+class ClipWriter(threading.Thread, ABC):
+    """
+    Encodes one clip on its own thread. Frames (`av.VideoFrame`s or RGB uint8 arrays) are handed over
+    through a bounded queue: `put` blocks while `queue_size` frames are waiting, so a clip of any length
+    is written in constant memory while the caller keeps decoding.
+    The clip is written to `<path>.part` and moved to `path` once complete.
+    Usage: `put()` frames, then `close()` and `finish()` (which raises if encoding failed), or `abort()`
+    to give up on the clip.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fps: int,
+        width: int,
+        height: int,
+        codec="libx264",
+        crf: Optional[int] = 23,
+        preset: Optional[str] = "veryfast",
+        queue_size=32,
+    ):
+        super().__init__(daemon=True)
+        self.path = path
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.error: Optional[Exception] = None
+        self._queue = Queue(maxsize=queue_size)
+        self._closed = False
+        self.start()
+
+    def put(self, frame: Frame) -> None:
+        self._queue.put(frame)
+
+    def close(self) -> None:
+        """No more frames; the clip is finalised in the background, `finish()` waits for it."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_DONE)
+
+    def finish(self) -> None:
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def abort(self) -> None:
+        """
+        Drop the frames still queued and the partial clip, and wait for the thread to exit; nothing is
+        written to `path` unless the clip had already been finalised.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+        self._queue.put(_ABORT)
+        self.join()
+
+    @abstractmethod
+    def _open(self, tmp_path: str) -> None:
+        pass
+
+    @abstractmethod
+    def _write(self, frame: Frame) -> None:
+        pass
+
+    @abstractmethod
+    def _finalize(self) -> None:
+        pass
+
+    def _cleanup(self) -> None:
+        """Release the encoder after a failure or an abort."""
+
+    def _discard(self, tmp_path: str) -> None:
+        self._cleanup()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def run(self) -> None:
+        tmp_path = f"{self.path}.part"
+        ended = False  # the _DONE or _ABORT marker was taken off the queue
+        try:
+            self._open(tmp_path)
+            while True:
+                frame = self._queue.get()
+                if frame is _DONE or frame is _ABORT:
+                    ended = True
+                    break
+                self._write(frame)
+            if frame is _ABORT:
+                self._discard(tmp_path)
+                return
+            self._finalize()
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self.error = e
+            # keep draining so the producer never blocks on a dead writer
+            while not ended:
+                frame = self._queue.get()
+                ended = frame is _DONE or frame is _ABORT
+            self._discard(tmp_path)
+
+
+class PyAVClipWriter(ClipWriter):
+    """Encodes in-process with PyAV, with the codec's own frame/slice threading enabled."""
+
+    def _open(self, tmp_path: str) -> None:
+        self._container = av.open(tmp_path, "w", format="mp4")
+        options = {}
+        if self.crf is not None:
+            options["crf"] = str(self.crf)
+        if self.preset is not None:
+            options["preset"] = self.preset
+        self._stream = self._container.add_stream(self.codec, rate=self.fps, options=options)
+        self._stream.width, self._stream.height, self._stream.pix_fmt = self.width, self.height, "yuv420p"
+        self._stream.thread_type = "AUTO"
+        self._stream.thread_count = 0  # one per core
+
+    def _write(self, frame: Frame) -> None:
+        if isinstance(frame, np.ndarray):
+            frame = av.VideoFrame.from_ndarray(frame, format="rgb24")
+        frame.pts = None  # let the encoder number the frames of the clip from 0
+        self._container.mux(self._stream.encode(frame))
+
+    def _finalize(self) -> None:
+        self._container.mux(self._stream.encode())
+        self._container.close()
+
+    def _cleanup(self) -> None:
+        if hasattr(self, "_container"):
+            try:
+                self._container.close()
+            except Exception:
+                pass
+
+
+class FfmpegClipWriter(ClipWriter):
+    """Streams raw RGB frames into an ffmpeg subprocess, so encoding runs outside the Python process."""
+
+    def command(self, tmp_path: str) -> List[str]:
+        cmd = ["ffmpeg", "-v", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24"]
+        cmd += ["-s", f"{self.width}x{self.height}", "-r", str(self.fps), "-i", "-"]
+        cmd += ["-an", "-c:v", self.codec]
+        if self.crf is not None:
+            cmd += ["-crf", str(self.crf)]
+        if self.preset is not None:
+            cmd += ["-preset", self.preset]
+        return cmd + ["-pix_fmt", "yuv420p", "-movflags", "+faststart", "-f", "mp4", tmp_path]
+
+    def _open(self, tmp_path: str) -> None:
+        self._proc = subprocess.Popen(self.command(tmp_path), stdin=subprocess.PIPE)
+
+    def _write(self, frame: Frame) -> None:
+        if isinstance(frame, av.VideoFrame):
+            frame = frame.to_ndarray(format="rgb24")
+        self._proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+
+    def _finalize(self) -> None:
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            raise subprocess.CalledProcessError(self._proc.returncode, self._proc.args)
+
+    def _cleanup(self) -> None:
+        if hasattr(self, "_proc"):
+            self._proc.kill()
+            self._proc.wait()
+
+
+clip_writers = {
+    "pyav": PyAVClipWriter,
+    "ffmpeg": FfmpegClipWriter,
+}
+
+
+def make_clip_writer(backend: str, path: str, fps: int, width: int, height: int, **kwargs) -> ClipWriter:
+    if backend not in clip_writers:
+        raise ValueError(f"Unknown clip writer backend {backend!r}, expected one of {list(clip_writers)}")
+    return clip_writers[backend](path, fps, width, height, **kwargs)
@@ -0,0 +1,192 @@
+#! /usr/bin/env python3
+import itertools
+import threading
+import time
+from collections import Counter
+from typing import *
+
+
+def is_throttle_status(status: Optional[int]) -> bool:
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """Global bytes/sec budget shared by every connection. `rate=None` means unlimited."""
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else (rate or 0)
+        self.total_bytes = 0
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        """Account for `nbytes` and sleep as long as the budget is overdrawn."""
+        with self._lock:
+            self.total_bytes += nbytes
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate) - nbytes
+            self._last = now
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AimdController:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit. The limit shrinks by `decrease` on
+    a throttling response (at most once per `interval`), and grows by `increase` every `interval`
+    in which throughput rose and nothing was throttled.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=10, increase=1, decrease=0.5, interval=10.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self._last_decrease = 0.0
+        self._last_tick = time.monotonic()
+        self._last_bytes = 0
+        self._last_throughput = 0.0
+        self._throttled = False
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    def on_throttle(self, status: Optional[int] = None) -> None:
+        with self._lock:
+            self._throttled = True
+            now = time.monotonic()
+            if now - self._last_decrease >= self.interval:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = now
+
+    def tick(self, total_bytes: int) -> None:
+        """Feed the running byte count; adjusts the limit once per `interval`."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_tick < self.interval:
+                return
+            throughput = (total_bytes - self._last_bytes) / (now - self._last_tick)
+            if not self._throttled and throughput > self._last_throughput:
+                self.limit = min(self.maximum, self.limit + self.increase)
+            self._last_tick, self._last_bytes = now, total_bytes
+            self._last_throughput = throughput
+            self._throttled = False
+
+
+class DownloadScheduler:
+    """
+    Runs `fn(*args)` for every submitted job on a pool of worker threads.
+    - concurrency follows an `AimdController`, bounded by `max_concurrency`
+    - at most `per_host_limit` jobs run against the same host at once
+    - the next job is always taken from the least covered group (e.g. the `search_string` with
+      the fewest dispatched downloads), in submission order within a group
+    - jobs failing with a throttling status (`e.status` 429/5xx) are retried after a backoff
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        max_concurrency=10,
+        initial_concurrency=4,
+        bytes_per_sec: Optional[float] = None,
+        per_host_limit=4,
+        max_attempts=3,
+        retry_delay=30.0,
+        on_result: Optional[Callable[[Tuple, Any], None]] = None,
+        on_error: Optional[Callable[[Tuple, Exception], None]] = None,
+    ):
+        self.fn = fn
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_result = on_result
+        self.on_error = on_error
+        self.bandwidth = TokenBucket(bytes_per_sec)
+        self.controller = AimdController(initial=initial_concurrency, maximum=max_concurrency)
+        self.coverage: Counter = Counter()
+
+        self._pending: List[Dict] = []
+        self._active = 0
+        self._active_hosts: Counter = Counter()
+        self._unfinished = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def submit(self, *args, group: Any = None, host: str = "") -> None:
+        with self._cond:
+            job = {"args": args, "group": group, "host": host, "seq": next(self._seq), "attempt": 0}
+            job["not_before"] = 0.0
+            self._pending.append(job)
+            self._unfinished += 1
+            self._cond.notify_all()
+
+    def _next_job(self) -> Optional[Dict]:
+        now = time.monotonic()
+        ready = [
+            job
+            for job in self._pending
+            if job["not_before"] <= now and self._active_hosts[job["host"]] < self.per_host_limit
+        ]
+        if not ready or self._active >= self.controller.concurrency:
+            return None
+        job = min(ready, key=lambda job: (self.coverage[job["group"]], job["seq"]))
+        self._pending.remove(job)
+        return job
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._unfinished == 0:
+                        return
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait(timeout=1.0)
+                    self.controller.tick(self.bandwidth.total_bytes)
+                self._active += 1
+                self._active_hosts[job["host"]] += 1
+                self.coverage[job["group"]] += 1
+
+            requeue = False
+            try:
+                result = self.fn(*job["args"])
+                if self.on_result is not None:
+                    self.on_result(job["args"], result)
+            except Exception as e:
+                job["attempt"] += 1
+                if is_throttle_status(getattr(e, "status", None)):
+                    self.controller.on_throttle(e.status)
+                    requeue = job["attempt"] < self.max_attempts
+                if not requeue and self.on_error is not None:
+                    self.on_error(job["args"], e)
+
+            with self._cond:
+                self._active -= 1
+                self._active_hosts[job["host"]] -= 1
+                if requeue:
+                    self.coverage[job["group"]] -= 1
+                    job["not_before"] = time.monotonic() + self.retry_delay * job["attempt"]
+                    self._pending.append(job)
+                else:
+                    self._unfinished -= 1
+                self.controller.tick(self.bandwidth.total_bytes)
+                self._cond.notify_all()
+
+    def run(self) -> None:
+        """Process every submitted job and return once all of them have finished."""
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.max_concurrency)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
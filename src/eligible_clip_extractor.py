@@ -1,16 +1,28 @@
-import math
-import re
+import contextlib
+import multiprocessing
 import os
-import pickle
+import time
+import traceback
+from collections import Counter
 from typing import *
 
+import cv2
 import decord
 import torch
-import torchvision
 from tqdm.auto import tqdm
 
-from face_mesh_detector import FaceMeshDetector
-from helper import get_all_files
+from adaptive_scan import adaptive_scan
+from clip_extractor import ClipExtractor
+from face_counter import face_counters, get_face_counter
+from face_detector_pool import FaceDetectorPool
+from face_marker_cache import FaceMarkerCache
+from frame_decoder import FrameReader, iter_scan_frames, video_info
+from frame_ring_buffer import SharedFrameScanner
+from helper import get_all_files, get_video_id
+from landmark_store import LandmarkWriter
+from metadata_manifest import iter_manifest
+from seek_index import get_seek_index
+from segmentation import segment
 
 decord.bridge.set_bridge("torch")
 
@@ -20,46 +32,208 @@ h264_cvt_dir = f"{dataset_root_dir}/h264_batch_2"
 download_dir = h264_cvt_dir
 extract_dir = f"{dataset_root_dir}/output_batch_2"
 download_list_txt = f"{dataset_root_dir}/download_list_batch_2.txt"
-metadata_file = f"{dataset_root_dir}/metadata_batch_2.pkl"
+metadata_file = f"{dataset_root_dir}/metadata_batch_2.jsonl"
 scaler = 0.3
-resize_fn = torchvision.transforms.Resize((int(1080 * scaler), int(1920 * scaler)))
+scan_width, scan_height = int(1920 * scaler), int(1080 * scaler)
 max_frames_per_batch = 80
 max_frames_per_clip = 700
+max_dropout_sec = 1  # a missed detection (no face) this long doesn't split a sequence
+extract_mode = "decode"  # "decode": frame accurate, "copy": no re-encoding, cuts at keyframes
+clip_writer_backend = "pyav"  # "pyav" or "ffmpeg", see clip_writer.py
+clip_codec = "libx264"
+clip_crf = 23
+clip_preset = "veryfast"
 is_gpu = False
 gpu_idx = 0
+num_detector_workers = 1
+num_scan_workers = 0  # > 0: decode into shared memory and detect with this many processes per video
+num_video_workers = 1  # > 1: process that many videos at once, one process each
+threads_per_video_worker = None  # cpu count / num_video_workers when None
+face_counter_backend = "mesh"  # "mesh", "detection", "tracking" or "dnn", see face_counter.py
+# "dense": every second. "adaptive" (opt-in): coarse samples refined where counts change; it can miss a
+# shot shorter than adaptive_coarse_step between two equal counts, compare with check_adaptive_scan first
+scan_mode = "dense"
+adaptive_coarse_step = 4  # seconds, keep well below min_sec_per_seq
+face_marker_cache = FaceMarkerCache(f"{dataset_root_dir}/face_marker_cache.sqlite")
+clip_extractor = ClipExtractor(
+    extract_dir,
+    mode=extract_mode,
+    writer_backend=clip_writer_backend,
+    codec=clip_codec,
+    crf=clip_crf,
+    preset=clip_preset,
+)
+landmark_dir = None  # keep the landmarks of scanned frames there (mesh backend without a detector pool)
 
 
-def get_num_faces_in_videos(video_path: str) -> List[int]:
+def effective_scan_mode(mode: Optional[str] = None) -> str:
+    # a tracking counter needs every sample of the video, in order
+    return "dense" if face_counters[face_counter_backend].sequential else mode or scan_mode
+
+
+def scan_params(mode: Optional[str] = None) -> Dict:
+    """Every setting that changes the face markers of a video, used as the face marker cache key."""
+    params = {
+        "backend": face_counter_backend,
+        "width": scan_width,
+        "height": scan_height,
+        "samples_per_sec": 1,
+        "mode": effective_scan_mode(mode),
+    }
+    if params["mode"] == "adaptive":
+        params["coarse_step"] = adaptive_coarse_step
+    return params
+
+
+def num_scan_samples(num_frames: int, fps: int) -> int:
+    """Number of face markers a complete scan of a video gives: one per second, but the last one."""
+    return len(range(0, num_frames - fps, fps))
+
+
+def get_num_faces_in_videos(
+    video_path: str,
+    detector_pool: Optional[FaceDetectorPool] = None,
+    mode: Optional[str] = None,
+    frame_scanner: Optional[SharedFrameScanner] = None,
+) -> Tuple[List[int], int]:
     """This function extract the number of faces for every second of the video
     specified in `video_path`.
 
     Args:
         video_path (str): the path to the video
+        detector_pool (FaceDetectorPool, optional): detector processes to spread the frames over.
+        Defaults to None (one detector session in this process).
+        mode (str, optional): "dense" or "adaptive". Defaults to None (`scan_mode`).
+        frame_scanner (SharedFrameScanner, optional): decoder and detector processes sharing frames
+        through shared memory; takes precedence over `detector_pool`. Defaults to None.
 
     Returns:
-        List[int]: each number in the list correspond to the number of faces in that frame
-        (one frame correspond to a second)
+        Tuple[List[int], int]: each number in the list correspond to the number of faces in that frame
+        (one frame correspond to a second), and the average fps of the video
     """
-    vr = decord.VideoReader(video_path, ctx=decord.gpu(gpu_idx) if is_gpu else decord.cpu(0))
-    avg_fps = math.ceil(vr.get_avg_fps())
-    max_nframes = len(vr)
+    max_nframes, avg_fps = video_info(video_path)
     print(f"{video_path}: Total number of frames = {max_nframes}, avg_fps = {avg_fps}")
 
-    batches = list(torch.arange(0, max_nframes - avg_fps, avg_fps).split(max_frames_per_batch))
-
-    face_markers = []
-    for batch in batches:
-        frame_batch = vr.get_batch(batch).permute(0, 3, 1, 2)
-        resize_batch = resize_fn(frame_batch)
-        resize_batch = resize_batch.permute(0, 2, 3, 1).cpu().numpy()
-        for frame in resize_batch:
-            FACE_DETECTOR = FaceMeshDetector(maxFaces=2)
-            _, faces = FACE_DETECTOR.findFaceMesh(frame, draw=True)
-            face_markers.append(len(faces))
+    # one frame per second, decoded straight at the scanning resolution
+    num_samples = num_scan_samples(max_nframes, avg_fps)
+    ctx = decord.gpu(gpu_idx) if is_gpu else None
+    mode = effective_scan_mode(mode)
+    if face_counters[face_counter_backend].sequential:
+        detector_pool = frame_scanner = None  # the samples must stay in order, in this process
+
+    if frame_scanner is not None:
+        if mode == "adaptive":
+            face_markers, num_counted = adaptive_scan(
+                lambda samples: frame_scanner.count(video_path, [sample * avg_fps for sample in samples]),
+                num_samples,
+                adaptive_coarse_step,
+            )
+            print(f"{video_path}: counted faces in {num_counted}/{num_samples} sampled frames")
+        else:
+            face_markers = frame_scanner.count(video_path, list(range(0, num_samples * avg_fps, avg_fps)))
+        return face_markers, avg_fps
+
+    with contextlib.ExitStack() as stack:
+        # batches come as (frame #s, frames)
+        if detector_pool is not None:
+
+            def count_batches(batches: Iterable) -> List[int]:
+                counts = detector_pool.count_faces(frames for _, frames in batches)
+                return [n for batch_counts in counts for n in batch_counts]
+
+        else:
+            counter = stack.enter_context(get_face_counter(face_counter_backend))
+            writer = None
+            if landmark_dir is not None and hasattr(counter, "landmarks"):
+                os.makedirs(landmark_dir, exist_ok=True)
+                prefix = f"{landmark_dir}/{os.path.splitext(os.path.basename(video_path))[0]}"
+                writer = stack.enter_context(LandmarkWriter(prefix))
+
+            def count_batches(batches: Iterable) -> List[int]:
+                if writer is None:
+                    return [n for _, frames in batches for n in counter.count(frames)]
+                counts = []
+                for indices, frames in batches:
+                    for frame_idx, faces in zip(indices, counter.landmarks(frames)):
+                        writer.append(frame_idx, faces)
+                        counts.append(len(faces))
+                return counts
+
+        if mode == "adaptive":
+            reader = FrameReader(video_path, scan_width, scan_height, ctx)
+
+            def count_samples(samples: List[int]) -> List[int]:
+                indices = [sample * avg_fps for sample in samples]
+                step = max_frames_per_batch
+                batches = [indices[i : i + step] for i in range(0, len(indices), step)]
+                return count_batches((batch, reader.get(batch)) for batch in batches)
+
+            face_markers, num_counted = adaptive_scan(count_samples, num_samples, adaptive_coarse_step)
+            print(f"{video_path}: counted faces in {num_counted}/{num_samples} sampled frames")
+        else:
+            frame_batches = iter_scan_frames(
+                video_path,
+                avg_fps,
+                num_samples,
+                scan_width,
+                scan_height,
+                batch_size=max_frames_per_batch,
+                ctx=ctx,
+            )
+
+            def indexed_batches():
+                indices, start = range(0, num_samples * avg_fps, avg_fps), 0
+                for frames in frame_batches:
+                    yield indices[start : start + len(frames)], frames
+                    start += len(frames)
+
+            face_markers = count_batches(indexed_batches())
+    return face_markers, avg_fps
+
+
+def get_face_markers(
+    video_path: str,
+    detector_pool: Optional[FaceDetectorPool] = None,
+    frame_scanner: Optional[SharedFrameScanner] = None,
+) -> Tuple[List[int], int]:
+    """`get_num_faces_in_videos`, read through the face marker cache."""
+    params = scan_params()
+    cached = face_marker_cache.get(video_path, params)
+    if cached is not None:
+        return cached
+    face_markers, avg_fps = get_num_faces_in_videos(video_path, detector_pool, frame_scanner=frame_scanner)
+    if len(face_markers) == num_scan_samples(*video_info(video_path)):
+        face_marker_cache.put(video_path, params, face_markers, avg_fps)
+    else:
+        print(f"{video_path}: incomplete scan ({len(face_markers)} face markers), not cached")
     return face_markers, avg_fps
 
 
-def choose_eligible_seqs(face_markers: List[int], fps: int, num_faces=1, min_sec_per_seq=10) -> List:
+def check_adaptive_scan(video_path: str, detector_pool: Optional[FaceDetectorPool] = None) -> bool:
+    """Scan `video_path` densely and adaptively and report whether both give the same eligible clips.
+
+    Args:
+        video_path (str): the path to the video
+        detector_pool (FaceDetectorPool, optional): detector processes to use. Defaults to None.
+
+    Returns:
+        bool: True when the eligible sequences are identical
+    """
+    dense_markers, avg_fps = get_num_faces_in_videos(video_path, detector_pool, mode="dense")
+    adaptive_markers, _ = get_num_faces_in_videos(video_path, detector_pool, mode="adaptive")
+    mismatches = sum(d != a for d, a in zip(dense_markers, adaptive_markers))
+    dense_seqs = choose_eligible_seqs(dense_markers, avg_fps, num_faces=1, min_sec_per_seq=10)
+    adaptive_seqs = choose_eligible_seqs(adaptive_markers, avg_fps, num_faces=1, min_sec_per_seq=10)
+    print(
+        f"{video_path}: {mismatches}/{len(dense_markers)} per-second counts differ, "
+        + f"eligible sequences {'match' if dense_seqs == adaptive_seqs else 'differ'}"
+    )
+    return dense_seqs == adaptive_seqs
+
+
+def choose_eligible_seqs(
+    face_markers: List[int], fps: int, num_faces=1, min_sec_per_seq=10, max_gap_sec: Optional[int] = None
+) -> List:
     """Only choose seqs with `num_faces` faces that's continuous for `min_sec_per_seq`.
 
     Args:
@@ -68,34 +242,21 @@ def choose_eligible_seqs(face_markers: List[int], fps: int, num_faces=1, min_sec
         fps (int): the fps of the video
         num_faces (int, optional): number of faces in a frame. Defaults to 1.
         min_sec_per_seq (int, optional): minimum number of seconds per sequences. Defaults to 10.
+        max_gap_sec (int, optional): seconds of missed detections (no face) tolerated inside a sequence;
+        any other face count still ends it. Defaults to None (`max_dropout_sec`).
 
     Returns:
-        List: a list of tuple, each tuple consist of 2 ints - (start frame #, end frame #)
+        List: a list of tuple, each tuple consist of 2 ints - (start frame #, end frame #), at most
+        `max_frames_per_clip` frames apart
     """
-    start_idx = -1
-    end_idx = 0
-    subseqlen = 0
-    seqnum = -1
-
-    eligible_seqs = []
-    for i, m in enumerate(face_markers):
-        if seqnum == -1:
-            start_idx = i
-            seqnum = m
-        if m != seqnum:
-            end_idx = i
-            subseqlen = end_idx - start_idx
-            if seqnum == num_faces and subseqlen >= min_sec_per_seq:
-                start_frame = i = start_idx * fps
-                end_frame = end_idx * fps
-                total_frame = end_frame - start_frame
-                num_frames_per_clip = max_frames_per_clip
-                while i < end_frame:
-                    eligible_seqs.append((i, i + num_frames_per_clip))
-                    i += num_frames_per_clip
-            start_idx = i
-            seqnum = m
-    return eligible_seqs
+    return segment(
+        face_markers,
+        fps,
+        num_faces=num_faces,
+        min_sec_per_seq=min_sec_per_seq,
+        max_gap_sec=max_dropout_sec if max_gap_sec is None else max_gap_sec,
+        max_frames_per_clip=max_frames_per_clip,
+    )
 
 
 def extract_seqs(video_path: str, start_idx: int, end_idx: int, fps: int, prefix=""):
@@ -109,10 +270,127 @@ def extract_seqs(video_path: str, start_idx: int, end_idx: int, fps: int, prefix
         prefix (str, optional): output file prefix. Defaults to "".
     """
     print("Extracting", video_path, start_idx, end_idx, fps, prefix)
-    vr = decord.VideoReader(video_path, ctx=decord.gpu(gpu_idx) if is_gpu else decord.cpu(0))
-    if start_idx >= len(vr): return
-    batches = vr.get_batch(list(torch.arange(start_idx, min(end_idx, len(vr))))).cpu()
-    torchvision.io.write_video(f"{extract_dir}/{prefix}_{start_idx}_{end_idx}.mp4", batches, fps)
+    index = get_seek_index(video_path)
+    if start_idx >= index.num_frames:
+        return
+    path = f"{extract_dir}/{prefix}_{start_idx}_{end_idx}.mp4"
+    writer = clip_extractor.writer(path, fps, index.width, index.height)
+    try:
+        # decoded from the keyframe before `start_idx`, a batch at a time while the writer encodes
+        for frames in index.read(start_idx, end_idx, batch_size=max_frames_per_batch):
+            for frame in frames:
+                writer.put(frame)
+    except BaseException:
+        writer.abort()  # no truncated clip under the final name
+        raise
+    writer.close()
+    writer.finish()
+
+
+def process_video(
+    url: str,
+    record: Dict,
+    detector_pool: Optional[FaceDetectorPool] = None,
+    frame_scanner: Optional[SharedFrameScanner] = None,
+) -> int:
+    """Count the faces in one downloaded video and extract its eligible clips.
+
+    Args:
+        url (str): the youtube url of the video
+        record (Dict): its metadata record (`path` and `search_string` are used)
+        detector_pool (FaceDetectorPool, optional): detector processes to use. Defaults to None.
+        frame_scanner (SharedFrameScanner, optional): shared-memory scanner to use. Defaults to None.
+
+    Returns:
+        int: the number of extracted clips
+    """
+    video_path = record["path"]
+    celeb_name = record["search_string"]
+    video_id = get_video_id(url)
+    if not os.path.exists(video_path):
+        return 0
+    if not os.path.exists(extract_dir):
+        os.makedirs(extract_dir, exist_ok=True)
+    face_markers, avg_fps = get_face_markers(video_path, detector_pool, frame_scanner)
+    eligible_seqs = choose_eligible_seqs(face_markers, avg_fps, num_faces=1, min_sec_per_seq=10)
+    # every clip in one pass over the video
+    paths = clip_extractor.extract(video_path, eligible_seqs, avg_fps, prefix=f"{celeb_name}_{video_id}")
+    return len(paths)
+
+
+_worker_id = 0
+
+
+def _init_video_worker(worker_ids, num_threads: int):
+    """Give this worker its id, its share of the cores and (with `is_gpu`) its own gpu."""
+    global _worker_id, gpu_idx
+    _worker_id = worker_ids.get()
+    cv2.setNumThreads(num_threads)
+    torch.set_num_threads(num_threads)
+    if is_gpu:
+        gpu_idx = _worker_id % max(1, torch.cuda.device_count())
+
+
+def _process_video_task(task: Tuple[str, Dict]) -> Tuple[int, str, int, float, Optional[str]]:
+    url, record = task
+    start = time.monotonic()
+    try:
+        num_clips, error = process_video(url, record), None
+    except Exception:
+        num_clips, error = 0, traceback.format_exc()
+    return _worker_id, url, num_clips, time.monotonic() - start, error
+
+
+def video_size(record: Dict) -> int:
+    # 1080p downloads have similar bitrates, so the file size stands in for the duration
+    return os.path.getsize(record["path"]) if os.path.exists(record["path"]) else 0
+
+
+def process_videos_parallel(
+    tasks: List[Tuple[str, Dict]], num_workers: int, num_threads: Optional[int] = None
+) -> None:
+    """Process videos on `num_workers` processes, largest first, so the run doesn't end on one long video.
+
+    Args:
+        tasks (List[Tuple[str, Dict]]): (url, metadata record) of every video
+        num_workers (int): number of worker processes
+        num_threads (int, optional): threads per worker for OpenMP/BLAS, OpenCV and torch.
+        Defaults to None (an equal share of the cores).
+    """
+    num_threads = num_threads or max(1, (os.cpu_count() or 1) // num_workers)
+    tasks = sorted(tasks, key=lambda task: video_size(task[1]), reverse=True)
+    ctx = multiprocessing.get_context("spawn")
+    worker_ids = ctx.Queue()
+    for i in range(num_workers):
+        worker_ids.put(i)
+
+    # thread pools read these when the libraries load, which happens as the workers start
+    thread_vars = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+    saved_env = {var: os.environ.get(var) for var in thread_vars}
+    os.environ.update({var: str(num_threads) for var in thread_vars})
+    try:
+        pool = ctx.Pool(num_workers, initializer=_init_video_worker, initargs=(worker_ids, num_threads))
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var)
+            else:
+                os.environ[var] = value
+
+    videos_done, clips_done, busy_seconds = Counter(), Counter(), Counter()
+    with pool, tqdm(total=len(tasks)) as progress:
+        for worker_id, url, num_clips, seconds, error in pool.imap_unordered(_process_video_task, tasks):
+            videos_done[worker_id] += 1
+            clips_done[worker_id] += num_clips
+            busy_seconds[worker_id] += seconds
+            if error is not None:
+                print(f"worker {worker_id}: {url} failed\n{error}")
+            progress.set_postfix_str(
+                " ".join(f"w{w}:{videos_done[w]}v/{clips_done[w]}c" for w in sorted(videos_done))
+            )
+            progress.update()
+    for w in sorted(videos_done):
+        print(f"worker {w}: {videos_done[w]} videos, {clips_done[w]} clips, {busy_seconds[w]:.0f}s busy")
 
 
 def main():
@@ -121,21 +399,29 @@ def main():
         os.makedirs(extract_dir)
 
     # video_paths = get_all_files(download_dir, suffix="mp4")
-    with open(metadata_file, "rb") as f:
-        metadata = pickle.load(f)
-
-    for url in tqdm(metadata):
-        video_path = metadata[url]["path"]
-        celeb_name = metadata[url]["search_string"]
-        video_id = re.findall(r"(?:v=|\/)([0-9A-Za-z_-]{11}).*", url)[0]
-        if not os.path.exists(video_path):
-            continue
-        dir, fname = os.path.split(video_path)
-        basename, ext = os.path.splitext(fname)
-        face_markers, avg_fps = get_num_faces_in_videos(video_path)
-        eligible_seqs = choose_eligible_seqs(face_markers, avg_fps, num_faces=1, min_sec_per_seq=10)
-        for start_idx, end_idx in tqdm(eligible_seqs):
-            extract_seqs(video_path, start_idx, end_idx, avg_fps, prefix=f"{celeb_name}_{video_id}")
+    records = {}
+    for url, record in iter_manifest(metadata_file):
+        records.setdefault(url, record)
+    tasks = list(records.items())
+    if num_video_workers > 1:
+        process_videos_parallel(tasks, num_video_workers, threads_per_video_worker)
+        return
+
+    detector_pool = frame_scanner = None
+    if not face_counters[face_counter_backend].sequential:
+        if num_scan_workers > 0:
+            frame_scanner = SharedFrameScanner(
+                scan_width, scan_height, num_scan_workers, face_counter_backend
+            )
+        elif num_detector_workers > 1:
+            detector_pool = FaceDetectorPool(num_detector_workers, face_counter_backend)
+    for url, record in tqdm(tasks):
+        process_video(url, record, detector_pool, frame_scanner)
+    if detector_pool is not None:
+        detector_pool.close()
+    if frame_scanner is not None:
+        frame_scanner.close()
+    print("Face marker cache:", face_marker_cache.stats())
 
 
 if __name__ == "__main__":
@@ -143,7 +429,7 @@ if __name__ == "__main__":
 
 # empty_mask = np.zeros((int(1080 * scaler), int(1920 * scaler), 3)).astype(np.uint8)
 # if len(faces) == 1:
-#     face = np.array(faces[0], dtype=np.int32)
+#     face = faces[0].astype(np.int32)
 #     sel = [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377,
 #         152, 148, 176, 140, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
 #     face = face[sel]
@@ -1,28 +1,51 @@
+import multiprocessing
 import os
+import traceback
+from collections import defaultdict
+from typing import *
 
-import decord
 import matplotlib.animation as anim
 import matplotlib.pyplot as plt
 import pandas as pd
+import psutil
 import torch
-from torchvision.io import write_png
+from torchvision.io import encode_png, write_file
 from tqdm.auto import tqdm
 
-decord.bridge.set_bridge("torch")
-
-
 from helper import get_all_files
+from seek_index import get_seek_index
 from youtube_video_scrapper import dataset_root_dir
 
-anno_df = pd.read_csv(f"{dataset_root_dir}/annotations.csv")
+frame_extract_dir = f"{dataset_root_dir}/frame_extract"
 
+num_workers = 4  # videos extracted at once, one process each
+
+# decoded frames held at once: each window of the annotated range is written out before the next is decoded
+max_chunk_bytes = 256 * 1024 * 1024
+
+peak_rss = 0
+
+
+def update_peak_rss() -> int:
+    """Resident memory of this process and its ffmpeg decoders now, folded into `peak_rss`."""
+    global peak_rss
+    proc = psutil.Process()
+    rss = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    peak_rss = max(peak_rss, rss)
+    return rss
 
-frame_extract_dir = f"{dataset_root_dir}/frame_extract"
-if not os.path.exists(frame_extract_dir):
-    os.makedirs(frame_extract_dir)
 
+Target = Tuple[int, int, str]  # (first frame #, end frame # (exclusive), destination dir)
+Span = Tuple[int, int, List[Target]]
 
-def extract_frames_from_anno(anno_line):
+
+def annotation_target(anno_line) -> Optional[Tuple[str, Target]]:
+    """The source video and the frames to extract (and where to) of one annotation line."""
     (
         _,
         celeb_name,
@@ -37,10 +60,7 @@ def extract_frames_from_anno(anno_line):
     ) = anno_line
     if int(res_w) != 1920 or int(res_h) != 1080:
         print(f"ERROR: {dataset_root_dir}/h264/{youtube_id}.mp4 does not have 1920x1080 resolution")
-        return False
-    if not os.path.exists(f"{dataset_root_dir}/h264/{youtube_id}.mp4"):
-        print(f"ERROR: {dataset_root_dir}/h264/{youtube_id}.mp4 does not exists")
-        return False
+        return None
 
     celeb_dir = f"{frame_extract_dir}/{'_'.join(celeb_name.split())}"
     pristine_dir = f"{celeb_dir}/pristine"
@@ -55,8 +75,6 @@ def extract_frames_from_anno(anno_line):
         else:
             save_to_dir = other_dir
     save_to_dir = f"{save_to_dir}/{youtube_id}"
-    if not os.path.exists(save_to_dir):
-        os.makedirs(save_to_dir)
 
     frame_begin, frame_end = map(int, frame_range.split("-"))
     if chop_begin == -1:
@@ -64,28 +82,113 @@ def extract_frames_from_anno(anno_line):
     if chop_end == -1:
         chop_end = frame_end - frame_begin
     chop_frame_begin, chop_frame_end = frame_begin + chop_begin, frame_begin + chop_end
-    
+    return youtube_id, (chop_frame_begin, chop_frame_end, save_to_dir)
+
+
+def merge_targets(targets: List[Target]) -> List[Span]:
+    """
+    Merge overlapping or adjacent frame ranges into spans, in frame order, each with the targets it serves,
+    so every frame is decoded once however many annotations (and destinations) include it.
+    """
+    spans = []
+    for begin, end, save_to_dir in sorted(targets):
+        if spans and begin <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+            spans[-1][2].append((begin, end, save_to_dir))
+        else:
+            spans.append([begin, end, [(begin, end, save_to_dir)]])
+    return [tuple(span) for span in spans]
+
+
+def plan_extraction(anno_df: pd.DataFrame) -> Dict[str, List[Span]]:
+    """The spans to extract from each source video (by youtube id) for every annotation line."""
+    targets = defaultdict(list)
+    for anno_line in anno_df.to_numpy():
+        planned = annotation_target(anno_line)
+        if planned is not None:
+            youtube_id, target = planned
+            targets[youtube_id].append(target)
+    return {youtube_id: merge_targets(video_targets) for youtube_id, video_targets in targets.items()}
+
+
+def extract_video_frames(youtube_id: str, spans: List[Span]) -> int:
+    """Write the frames of every span of one video, opened once and read in frame order; returns # of pngs."""
+    video_path = f"{dataset_root_dir}/h264/{youtube_id}.mp4"
+    if not os.path.exists(video_path):
+        print(f"ERROR: {video_path} does not exists")
+        return 0
+
+    index = get_seek_index(video_path)
+    chunk_frames = max(1, max_chunk_bytes // (index.width * index.height * 3))
+    num_written = 0
+    for begin, end, targets in spans:
+        if end > index.num_frames:
+            print(f"WARNING: {video_path} has chop_frame_end={end} > max={index.num_frames}")
+            end = index.num_frames
+        for save_to_dir in {save_to_dir for _, _, save_to_dir in targets}:
+            os.makedirs(save_to_dir, exist_ok=True)
+        # ffmpeg jumps to the keyframe before the span instead of indexing the whole container
+        idx = begin
+        for frames in index.read(begin, end, batch_size=chunk_frames):
+            for frame in frames:
+                paths = [
+                    f"{save_to_dir}/{idx}.png"
+                    for target_begin, target_end, save_to_dir in targets
+                    if target_begin <= idx < target_end and not os.path.exists(f"{save_to_dir}/{idx}.png")
+                ]
+                if paths:
+                    # encoded once, written to every annotation sharing the frame
+                    data = encode_png(torch.from_numpy(frame).permute(2, 0, 1), compression_level=0)
+                    for path in paths:
+                        write_file(path, data)
+                    num_written += len(paths)
+                idx += 1
+            update_peak_rss()
+    return num_written
+
+
+def _extract_video_task(task: Tuple[str, List[Span]]) -> Tuple[str, int, int, Optional[str]]:
+    youtube_id, spans = task
+    try:
+        num_written, error = extract_video_frames(youtube_id, spans), None
+    except Exception:
+        num_written, error = 0, traceback.format_exc()
+    return youtube_id, num_written, peak_rss, error
+
+
+def main():
+    anno_df = pd.read_csv(f"{dataset_root_dir}/annotations.csv")
+    os.makedirs(frame_extract_dir, exist_ok=True)
+
+    plan = plan_extraction(anno_df)
+    # longest first, so the run doesn't end on one long video
+    tasks = sorted(plan.items(), key=lambda task: sum(end - begin for begin, end, _ in task[1]), reverse=True)
+    print(f"{len(anno_df)} annotations -> {sum(map(len, plan.values()))} spans in {len(plan)} videos")
+
+    if num_workers > 1:
+        pool = multiprocessing.get_context("spawn").Pool(num_workers)
+        results = pool.imap_unordered(_extract_video_task, tasks)
+    else:
+        pool = None
+        results = map(_extract_video_task, tasks)
+    max_rss, num_written = 0, 0
     try:
-        vr = decord.VideoReader(f"{dataset_root_dir}/h264/{youtube_id}.mp4")
-        if chop_frame_end > len(vr):
-            print(f"WARNING: {dataset_root_dir}/h264/{youtube_id}.mp4 has chop_frame_end={chop_frame_end} > max={len(vr)}")
-            chop_frame_end = len(vr)
-        fr_batch = list(range(chop_frame_begin, chop_frame_end))
-        batch = vr.get_batch(fr_batch).permute(0, 3, 1, 2)
-        del vr
-
-        for idx, im in zip(fr_batch, batch):
-            if not os.path.exists(f"{save_to_dir}/{idx}.png"):
-                write_png(im, f"{save_to_dir}/{idx}.png", compression_level=0)
-
-        return True
-    except Exception as e:
-        print(f"ERROR: {dataset_root_dir}/h264/{youtube_id}.mp4 fail with {e}")
-        return False
-
-
-with tqdm(anno_df["celeb_name"].unique()) as pbar:
-    for celeb in pbar:
-        pbar.set_description(f"Celeb={celeb}")
-        for anno_line in tqdm(anno_df.query(f"`celeb_name` == '{celeb}'").to_numpy(), desc=f"Celeb={celeb}"):
-            extract_frames_from_anno(anno_line)
+        with tqdm(results, total=len(tasks)) as pbar:
+            for youtube_id, num_pngs, rss, error in pbar:
+                if error is not None:
+                    print(f"ERROR: {dataset_root_dir}/h264/{youtube_id}.mp4 fail with\n{error}")
+                num_written += num_pngs
+                max_rss = max(max_rss, rss)
+                pbar.set_postfix(pngs=num_written, peak_rss=f"{max_rss / 2**20:.0f}MiB")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print(
+        f"{num_written} pngs written. Peak RSS per worker: {max_rss / 2**20:.0f}MiB "
+        f"(max_chunk_bytes={max_chunk_bytes / 2**20:.0f}MiB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Face counting backends.
+Clip eligibility only needs the number of faces in each sampled frame, so the backends here answer
+just that, from the full 468-landmark mesh down to a bounding-box detector that takes whole batches.
+"""
+import os
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import *
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from face_mesh_detector import FaceMeshDetector
+
+# OpenCV's res10 SSD face detector, not shipped here: deploy.prototxt is in samples/dnn/face_detector of
+# https://github.com/opencv/opencv, the caffemodel in the dnn_samples_face_detector_20170830 branch of
+# https://github.com/opencv/opencv_3rdparty
+dnn_model_dir = "models"
+dnn_prototxt = f"{dnn_model_dir}/deploy.prototxt"
+dnn_caffemodel = f"{dnn_model_dir}/res10_300x300_ssd_iter_140000.caffemodel"
+
+
+class FaceCounter(ABC):
+    """
+    Counts faces in batches of RGB uint8 frames shaped (N, H, W, 3).
+    A `sequential` counter carries state from frame to frame: it must see the samples of one video, in
+    order, and be rebuilt for the next video.
+    """
+
+    sequential = False
+
+    @abstractmethod
+    def count(self, frames: np.ndarray) -> List[int]:
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MeshFaceCounter(FaceCounter):
+    """The full FaceMesh; the reference the other backends are compared against."""
+
+    def __init__(self, max_faces=2, min_confidence=0.5, static_mode=True):
+        self.detector = FaceMeshDetector(
+            staticMode=static_mode, maxFaces=max_faces, minDetectionCon=min_confidence
+        )
+
+    def landmarks(self, frames: np.ndarray) -> List[np.ndarray]:
+        """Landmarks of every frame, each shaped (num_faces, num_landmarks, 2)."""
+        return [self.detector.findFaceMesh(frame, draw=False)[1] for frame in frames]
+
+    def count(self, frames: np.ndarray) -> List[int]:
+        return [len(faces) for faces in self.landmarks(frames)]
+
+    def close(self):
+        self.detector.close()
+
+
+class DetectionFaceCounter(FaceCounter):
+    """mediapipe face detection: bounding boxes only, no landmark regression."""
+
+    def __init__(self, min_confidence=0.5, model_selection=1):
+        """
+        :param model_selection: 0 for faces within ~2m of the camera, 1 for faces up to ~5m
+        """
+        self.detector = mp.solutions.face_detection.FaceDetection(
+            model_selection=model_selection, min_detection_confidence=min_confidence
+        )
+
+    def count(self, frames: np.ndarray) -> List[int]:
+        return [len(self.detector.process(frame).detections or []) for frame in frames]
+
+    def close(self):
+        self.detector.close()
+
+
+class TrackingFaceCounter(FaceCounter):
+    """
+    Counts faces over the samples of one video, in order, running the face detector only when needed:
+    every `redetect_every` samples, when a tracked face is lost, and on every sample without a face.
+    In between, a FaceMesh in tracking mode follows the faces of the last detection. Its graph is built
+    for exactly that many faces, as mediapipe runs its own detector on every frame where fewer faces are
+    tracked than the graph allows; one graph per face count is kept for the whole video.
+    A face entering while others are tracked is picked up by the next scheduled detection.
+
+    Every sample also gets a confidence, kept in `confidences`: the face detection scores of the counted
+    faces at the last detection (the lowest of them; 1 - the best rejected score when there is none).
+    """
+
+    sequential = True
+
+    def __init__(
+        self, max_faces=2, min_detection_confidence=0.5, min_tracking_confidence=0.5, redetect_every=5
+    ):
+        self.max_faces = max_faces
+        self.min_detection_confidence = min_detection_confidence
+        self.min_tracking_confidence = min_tracking_confidence
+        self.redetect_every = redetect_every
+        self.detection = mp.solutions.face_detection.FaceDetection(
+            model_selection=1, min_detection_confidence=0.0
+        )
+        self.meshes: Dict[int, Any] = {}
+        self.confidences: List[float] = []
+        self.num_detections = 0
+        self._since_detection = 0
+        self._count: Optional[int] = None
+        self._confidence = 1.0
+
+    def _num_tracked(self, frame: np.ndarray, num_faces: int) -> int:
+        if num_faces not in self.meshes:
+            self.meshes[num_faces] = mp.solutions.face_mesh.FaceMesh(
+                static_image_mode=False,
+                max_num_faces=num_faces,
+                min_detection_confidence=self.min_detection_confidence,
+                min_tracking_confidence=self.min_tracking_confidence,
+            )
+        return len(self.meshes[num_faces].process(frame).multi_face_landmarks or [])
+
+    def _detect(self, frame: np.ndarray) -> int:
+        self.num_detections += 1
+        self._since_detection = 0
+        scores = sorted((d.score[0] for d in self.detection.process(frame).detections or []), reverse=True)
+        count = min(sum(score >= self.min_detection_confidence for score in scores), self.max_faces)
+        if count > 0:
+            self._confidence = scores[count - 1]
+            self._num_tracked(frame, count)  # (re)seed the tracks
+        else:
+            self._confidence = 1.0 - scores[0] if scores else 1.0
+        return count
+
+    def count_with_confidence(self, frames: np.ndarray) -> List[Tuple[int, float]]:
+        results = []
+        for frame in frames:
+            if not self._count or self._since_detection >= self.redetect_every:
+                count = self._detect(frame)
+            else:
+                count = self._count
+                self._since_detection += 1
+                if self._num_tracked(frame, count) < count:
+                    # a track fell below min_tracking_confidence: a shot change or a face leaving
+                    count = self._detect(frame)
+            self._count = count
+            self.confidences.append(self._confidence)
+            results.append((count, self._confidence))
+        return results
+
+    def count(self, frames: np.ndarray) -> List[int]:
+        return [count for count, _ in self.count_with_confidence(frames)]
+
+    def close(self):
+        for mesh in self.meshes.values():
+            mesh.close()
+        self.detection.close()
+
+
+class DnnFaceCounter(FaceCounter):
+    """OpenCV's res10 SSD face detector; a whole batch goes through the network in one forward pass."""
+
+    def __init__(self, min_confidence=0.5, prototxt=dnn_prototxt, caffemodel=dnn_caffemodel, input_size=300):
+        for path in (prototxt, caffemodel):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} is missing, see `dnn_model_dir` in face_counter.py")
+        self.min_confidence = min_confidence
+        self.input_size = input_size
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+
+    def count(self, frames: np.ndarray) -> List[int]:
+        # the model expects BGR: swapRB flips the frames, and the mean (given in RGB order) with them
+        blob = cv2.dnn.blobFromImages(
+            list(frames), 1.0, (self.input_size, self.input_size), (123.0, 177.0, 104.0), swapRB=True
+        )
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]  # rows of (image_idx, class, confidence, x1, y1, x2, y2)
+        confident = detections[detections[:, 2] >= self.min_confidence]
+        return np.bincount(confident[:, 0].astype(np.int64), minlength=len(frames)).tolist()
+
+
+face_counters = {
+    "mesh": MeshFaceCounter,
+    "detection": DetectionFaceCounter,
+    "tracking": TrackingFaceCounter,
+    "dnn": DnnFaceCounter,
+}
+
+
+def get_face_counter(backend: str, **kwargs) -> FaceCounter:
+    if backend not in face_counters:
+        raise ValueError(f"Unknown face counter backend {backend!r}, expected one of {list(face_counters)}")
+    return face_counters[backend](**kwargs)
+
+
+def compare_face_counters(
+    frame_batches: Iterable[np.ndarray],
+    backends: Iterable[str] = ("detection", "tracking", "dnn"),
+    reference="mesh",
+) -> Dict[str, Dict]:
+    """
+    Run every backend over the same frames (the samples of one video, in order) and compare them with
+    `reference`. A backend whose model files are missing is skipped.
+    Returns per backend the frames/sec and the fraction of frames whose count agrees with the reference,
+    plus for a tracking counter the fraction of frames the detector ran on.
+    """
+    counters: Dict[str, FaceCounter] = {}
+    try:
+        counters[reference] = get_face_counter(reference)
+        for backend in backends:
+            if backend == reference:
+                continue
+            try:
+                counters[backend] = get_face_counter(backend)
+            except FileNotFoundError as e:
+                print(f"skipping {backend}: {e}")
+        backends = list(counters)
+        counts = {backend: [] for backend in backends}
+        seconds = dict.fromkeys(backends, 0.0)
+        for frames in frame_batches:
+            for backend, counter in counters.items():
+                start = time.perf_counter()
+                counts[backend] += counter.count(frames)
+                seconds[backend] += time.perf_counter() - start
+    finally:
+        for counter in counters.values():
+            counter.close()
+
+    expected = np.array(counts[reference])
+    stats = {
+        backend: {
+            "fps": len(expected) / seconds[backend] if seconds[backend] > 0 else 0.0,
+            "agreement": float(np.mean(np.array(counts[backend]) == expected)) if len(expected) else 1.0,
+        }
+        for backend in backends
+    }
+    for backend, counter in counters.items():
+        if hasattr(counter, "num_detections") and len(expected):
+            stats[backend]["detection_rate"] = counter.num_detections / len(expected)
+    return stats
+
+
+def main():
+    import decord
+
+    video_path = sys.argv[1]
+    vr = decord.VideoReader(video_path, width=576, height=324)
+    fps = round(vr.get_avg_fps())
+    samples = np.arange(0, len(vr), fps)
+    batches = [batch for batch in np.array_split(samples, len(samples) // 32 + 1) if len(batch)]
+    frame_batches = (vr.get_batch(list(batch)).asnumpy() for batch in batches)
+    for backend, stats in compare_face_counters(frame_batches).items():
+        line = f"{backend}: {stats['fps']:.1f} frames/sec, {100 * stats['agreement']:.1f}% agreement"
+        if "detection_rate" in stats:
+            line += f", detector on {100 * stats['detection_rate']:.1f}% of frames"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
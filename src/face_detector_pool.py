@@ -0,0 +1,60 @@
+"""
+Pool of face detector worker processes.
+Every worker builds one face counter when it starts and keeps it for its whole lifetime,
+so frame batches sent to the pool never pay the model setup again.
+"""
+import multiprocessing
+from collections import deque
+from typing import *
+
+import numpy as np
+
+from face_counter import FaceCounter, get_face_counter
+
+_counter: Optional[FaceCounter] = None
+
+
+def _init_worker(backend: str, counter_kwargs: Dict):
+    global _counter
+    _counter = get_face_counter(backend, **counter_kwargs)
+
+
+def _count_faces(frames: np.ndarray) -> List[int]:
+    return _counter.count(frames)
+
+
+class FaceDetectorPool:
+    """
+    :param num_workers: Number of detector processes (one face counter each)
+    :param backend: Face counter backend, see `face_counter.face_counters`
+    :param counter_kwargs: Keyword arguments forwarded to the face counter
+    """
+
+    def __init__(self, num_workers=4, backend="mesh", **counter_kwargs):
+        self.num_workers = num_workers
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            num_workers, initializer=_init_worker, initargs=(backend, counter_kwargs)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def count_faces(self, frame_batches: Iterable[np.ndarray]) -> Iterator[List[int]]:
+        """
+        Yields the number of faces in every frame of each batch, in order. Batches are processed in
+        parallel, and at most two per worker are in flight so decoding never runs far ahead.
+        """
+        in_flight = deque()
+        for frames in frame_batches:
+            in_flight.append(self._pool.apply_async(_count_faces, (frames,)))
+            if len(in_flight) >= 2 * self.num_workers:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import *
+
+schema = """
+CREATE TABLE IF NOT EXISTS face_markers (
+    file_key TEXT,
+    params TEXT,
+    path TEXT,
+    markers TEXT,
+    fps INTEGER,
+    created_at REAL,
+    PRIMARY KEY (file_key, params)
+)
+"""
+
+
+def file_key(path: str, block_size=1024 * 1024) -> str:
+    """Identity of a video's content: its size and a hash of its first and last `block_size` bytes."""
+    size = os.path.getsize(path)
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        h.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            h.update(f.read(block_size))
+    return f"{size}:{h.hexdigest()}"
+
+
+class FaceMarkerCache:
+    """
+    On-disk (sqlite) cache of the per-second face counts of a video and its fps, keyed by the file's
+    content (`file_key`) and the detector settings that produced them (backend, scale, sampling, ...),
+    so segmentation parameters can change without scanning a single frame again.
+    Safe to share between threads and processes (each gets its own connection).
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._pid = os.getpid()
+        # file keys by (path, size, mtime), so an unchanged file is only hashed once per process
+        self._keys: Dict[Tuple[str, int, int], str] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local, self._pid = threading.local(), os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(schema)
+            self._local.conn = conn
+        return conn
+
+    def _file_key(self, path: str) -> str:
+        st = os.stat(path)
+        stat_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if stat_key not in self._keys:
+            self._keys[stat_key] = file_key(path)
+        return self._keys[stat_key]
+
+    @staticmethod
+    def _params_key(params: Dict) -> str:
+        return json.dumps(params, sort_keys=True)
+
+    def get(self, path: str, params: Dict) -> Optional[Tuple[List[int], int]]:
+        """The cached (face markers, fps) of `path` scanned with `params`, or None."""
+        row = (
+            self._conn()
+            .execute(
+                "SELECT markers, fps FROM face_markers WHERE file_key = ? AND params = ?",
+                (self._file_key(path), self._params_key(params)),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def put(self, path: str, params: Dict, markers: List[int], fps: int) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO face_markers VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self._file_key(path),
+                    self._params_key(params),
+                    os.path.abspath(path),
+                    json.dumps(list(markers)),
+                    fps,
+                    time.time(),
+                ),
+            )
+
+    def stats(self) -> Dict:
+        """Hits and misses of this process, plus the number of entries and videos per detector setting."""
+        rows = (
+            self._conn()
+            .execute("SELECT params, COUNT(*), COUNT(DISTINCT file_key) FROM face_markers GROUP BY params")
+            .fetchall()
+        )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": sum(num_entries for _, num_entries, _ in rows),
+            "params": {params: num_videos for params, _, num_videos in rows},
+        }
+
+    def invalidate(self, path: Optional[str] = None, params: Optional[Dict] = None) -> int:
+        """
+        Drop the entries of `path` (any content recorded under that path, and its current content),
+        of `params`, of both, or everything when neither is given. Returns the number of dropped entries.
+        """
+        where, args = [], []
+        if path is not None:
+            keys = [os.path.abspath(path)]
+            if os.path.exists(path):
+                keys.append(self._file_key(path))
+            where.append("(path = ? OR file_key = ?)")
+            args += keys if len(keys) == 2 else keys * 2
+        if params is not None:
+            where.append("params = ?")
+            args.append(self._params_key(params))
+        query = "DELETE FROM face_markers" + (" WHERE " + " AND ".join(where) if where else "")
+        with self._conn() as conn:
+            return conn.execute(query, args).rowcount
@@ -6,6 +6,7 @@ Website: https://www.computervision.zone/
 
 import cv2
 import mediapipe as mp
+import numpy as np
 
 
 class FaceMeshDetector:
@@ -37,38 +38,51 @@ class FaceMeshDetector:
         Finds face landmarks in BGR Image.
         :param img: Image to find the face landmarks in.
         :param draw: Flag to draw the output on the image.
-        :return: Image with or without drawings
+        :return: Image with or without drawings, and the landmarks in pixels as an int16 array of shape
+                 (num_faces, num_landmarks, 2) holding (x, y)
         """
         # self.imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         self.imgRGB = img
         self.results = self.faceMesh.process(self.imgRGB)
-        faces = []
-        if self.results.multi_face_landmarks:
-            for faceLms in self.results.multi_face_landmarks:
-                if draw:
-                    self.mpDraw.draw_landmarks(
-                        img, faceLms, self.mpFaceMeshConn.FACEMESH_TESSELATION, self.drawSpec, self.drawSpec
-                    )
-                face = []
-                for id, lm in enumerate(faceLms.landmark):
-                    ih, iw, ic = img.shape
-                    x, y = int(lm.x * iw), int(lm.y * ih)
-                    face.append([x, y])
-                faces.append(face)
-        self.faceMesh.close()
+        multiFaceLms = self.results.multi_face_landmarks or []
+        if draw:
+            for faceLms in multiFaceLms:
+                self.mpDraw.draw_landmarks(
+                    img, faceLms, self.mpFaceMeshConn.FACEMESH_TESSELATION, self.drawSpec, self.drawSpec
+                )
+        numLms = len(multiFaceLms[0].landmark) if multiFaceLms else 0
+        coords = np.fromiter(
+            (v for faceLms in multiFaceLms for lm in faceLms.landmark for v in (lm.x, lm.y)),
+            dtype=np.float32,
+            count=2 * numLms * len(multiFaceLms),
+        ).reshape(len(multiFaceLms), numLms, 2)
+        ih, iw = img.shape[:2]
+        faces = (coords * np.array([iw, ih], dtype=np.float32)).astype(np.int16)
         return img, faces
 
+    def close(self):
+        """
+        Releases the mediapipe graph. The detector can be reused for any number of images until then.
+        """
+        self.faceMesh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 def main():
     cap = cv2.VideoCapture(0)
-    detector = FaceMeshDetector(maxFaces=2)
-    while True:
-        success, img = cap.read()
-        img, faces = detector.findFaceMesh(img)
-        if faces:
-            print(faces[0])
-        cv2.imshow("Image", img)
-        cv2.waitKey(1)
+    with FaceMeshDetector(maxFaces=2) as detector:
+        while True:
+            success, img = cap.read()
+            img, faces = detector.findFaceMesh(img)
+            if len(faces):
+                print(faces[0])
+            cv2.imshow("Image", img)
+            cv2.waitKey(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+import math
+import shutil
+from typing import *
+
+import decord
+import numpy as np
+
+from seek_index import get_seek_index, iter_ffmpeg_frames
+
+
+def video_info(video_path: str) -> Tuple[int, int]:
+    """Number of frames and the average fps (rounded up) of a video, from its seek index when possible."""
+    if shutil.which("ffprobe") is not None:
+        index = get_seek_index(video_path)
+        return index.num_frames, math.ceil(index.fps)
+    vr = decord.VideoReader(video_path, ctx=decord.cpu(0))
+    return len(vr), math.ceil(vr.get_avg_fps())
+
+
+def _as_numpy(batch) -> np.ndarray:
+    # decord returns its own NDArray or a torch tensor depending on the active bridge
+    return batch.asnumpy() if hasattr(batch, "asnumpy") else batch.numpy()
+
+
+def _iter_ffmpeg(
+    video_path: str, step: int, num_samples: int, width: int, height: int, batch_size: int
+) -> Iterator[np.ndarray]:
+    """One sequential ffmpeg decode; only every `step`-th frame is scaled and converted to rgb24."""
+    cmd = ["ffmpeg", "-v", "error", "-i", video_path, "-an", "-sn"]
+    cmd += ["-vf", f"select=not(mod(n\\,{step})),scale={width}:{height}:flags=bilinear", "-vsync", "0"]
+    cmd += ["-frames:v", str(num_samples), "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    return iter_ffmpeg_frames(cmd, num_samples, width, height, batch_size)
+
+
+class FrameReader:
+    """Random access to frames that decord resizes to `width`x`height` while decoding."""
+
+    def __init__(self, video_path: str, width: int, height: int, ctx=None):
+        self.vr = decord.VideoReader(video_path, ctx=ctx or decord.cpu(0), width=width, height=height)
+
+    def get(self, indices: List[int]) -> np.ndarray:
+        """Contiguous uint8 RGB frames shaped (N, height, width, 3), read in increasing order."""
+        return np.ascontiguousarray(_as_numpy(self.vr.get_batch(sorted(indices))))
+
+
+def _iter_decord(
+    video_path: str, step: int, num_samples: int, width: int, height: int, batch_size: int, ctx=None
+) -> Iterator[np.ndarray]:
+    reader = FrameReader(video_path, width, height, ctx)
+    indices = list(range(0, num_samples * step, step))
+    for i in range(0, len(indices), batch_size):
+        yield reader.get(indices[i : i + batch_size])
+
+
+def iter_scan_frames(
+    video_path: str,
+    step: int,
+    num_samples: int,
+    width: int,
+    height: int,
+    batch_size=80,
+    ctx=None,
+    backend: Optional[str] = None,
+) -> Iterator[np.ndarray]:
+    """
+    Frames 0, step, 2*step, ... (`num_samples` of them) already scaled to `width`x`height`, yielded as
+    contiguous uint8 RGB batches shaped (N, height, width, 3). The video is decoded once, front to back.
+
+    :param ctx: decord context for the decord backend (e.g. `decord.gpu(0)`)
+    :param backend: "ffmpeg" or "decord"; ffmpeg when it is installed and no decord context is given
+    """
+    if backend is None:
+        backend = "ffmpeg" if ctx is None and shutil.which("ffmpeg") is not None else "decord"
+    if backend == "ffmpeg":
+        return _iter_ffmpeg(video_path, step, num_samples, width, height, batch_size)
+    return _iter_decord(video_path, step, num_samples, width, height, batch_size, ctx)
@@ -0,0 +1,219 @@
+"""
+Shared-memory frame ring buffer between one decoder process and several detector processes.
+Decoded frames are written into fixed-size slots of a `multiprocessing.shared_memory` block; the
+processes only exchange slot numbers and face counts, never frames.
+"""
+import multiprocessing
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from typing import *
+
+import numpy as np
+
+from face_counter import get_face_counter
+from frame_decoder import FrameReader, iter_scan_frames
+
+
+class FrameRingBuffer:
+    """
+    `num_slots` slots, each holding up to `batch_size` RGB uint8 frames of `height`x`width`.
+    `free` holds the slots a producer may fill, `filled` the (slot, scan id, batch #, number of frames)
+    messages for the consumers, who put the slot back on `free` once they are done with it.
+    """
+
+    def __init__(self, num_slots: int, batch_size: int, height: int, width: int, ctx=None):
+        ctx = ctx or multiprocessing.get_context("spawn")
+        self.num_slots = num_slots
+        self.slot_shape = (batch_size, height, width, 3)
+        self.shm = SharedMemory(create=True, size=num_slots * int(np.prod(self.slot_shape)))
+        self.free = ctx.Queue()
+        self.filled = ctx.Queue()
+        for i in range(num_slots):
+            self.free.put(i)
+
+    def __getstate__(self):
+        # child processes attach to the same block by name
+        return {
+            "num_slots": self.num_slots,
+            "slot_shape": self.slot_shape,
+            "name": self.shm.name,
+            "free": self.free,
+            "filled": self.filled,
+        }
+
+    def __setstate__(self, state):
+        self.num_slots, self.slot_shape = state["num_slots"], state["slot_shape"]
+        self.shm = SharedMemory(name=state["name"])
+        self.free, self.filled = state["free"], state["filled"]
+
+    def slots(self) -> np.ndarray:
+        return np.ndarray((self.num_slots,) + self.slot_shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def close(self) -> None:
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+def _decode_worker(ring: FrameRingBuffer, requests, results, width: int, height: int):
+    slots = ring.slots()
+    batch_size = ring.slot_shape[0]
+    reader, reader_path = None, None  # kept across scans of one video (adaptive mode rescans it often)
+    try:
+        while True:
+            msg = requests.get()
+            if msg is None:
+                break
+            scan_id, video_path, indices = msg
+            try:
+                step = indices[1] - indices[0] if len(indices) > 1 else 1
+                if indices == list(range(0, len(indices) * step, step)):
+                    # evenly spaced from the start: one sequential decode
+                    batches = iter_scan_frames(
+                        video_path, step, len(indices), width, height, batch_size=batch_size
+                    )
+                else:
+                    if reader_path != video_path:
+                        reader = None  # release the previous video before opening the next
+                        reader, reader_path = FrameReader(video_path, width, height), video_path
+                    batches = (
+                        reader.get(indices[i : i + batch_size]) for i in range(0, len(indices), batch_size)
+                    )
+                num_batches = 0
+                for batch_no, frames in enumerate(batches):
+                    slot = ring.free.get()
+                    slots[slot, : len(frames)] = frames
+                    ring.filled.put((slot, scan_id, batch_no, len(frames)))
+                    num_batches += 1
+                results.put((scan_id, "done", num_batches, None))
+            except Exception:
+                results.put((scan_id, "error", None, traceback.format_exc()))
+    finally:
+        del slots
+        ring.close()
+
+
+def _detect_worker(ring: FrameRingBuffer, results, backend: str, counter_kwargs: Dict):
+    slots = ring.slots()
+    try:
+        with get_face_counter(backend, **counter_kwargs) as counter:
+            while True:
+                msg = ring.filled.get()
+                if msg is None:
+                    break
+                slot, scan_id, batch_no, n = msg
+                try:
+                    results.put((scan_id, "counts", batch_no, counter.count(slots[slot, :n])))
+                except Exception:
+                    results.put((scan_id, "error", batch_no, traceback.format_exc()))
+                finally:
+                    ring.free.put(slot)
+    finally:
+        del slots
+        ring.close()
+
+
+class SharedFrameScanner:
+    """
+    Counts faces in the frames of one video with `num_workers` detector processes fed by a decoder
+    process through a `FrameRingBuffer`, so decoding and detection overlap and a single video uses
+    `num_workers` + 1 cores. The decoder and detector processes (and their models) live until `close()`;
+    if one of them dies, `count` raises and the scanner can't be used again.
+
+    :param width: Width of the frames, as decoded
+    :param height: Height of the frames, as decoded
+    :param backend: Face counter backend, see `face_counter.face_counters` (not a sequential one)
+    :param poll_interval: Seconds between checks that the processes are still alive while waiting
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        num_workers=4,
+        backend="mesh",
+        batch_size=16,
+        num_slots: Optional[int] = None,
+        poll_interval=5.0,
+        **counter_kwargs,
+    ):
+        self.width = width
+        self.height = height
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._scan_id = 0
+        self._failed: Optional[str] = None
+        self._ctx = multiprocessing.get_context("spawn")
+        self.ring = FrameRingBuffer(num_slots or 2 * num_workers, batch_size, height, width, self._ctx)
+        self.requests = self._ctx.Queue()
+        self.results = self._ctx.Queue()
+        self.decoder = self._ctx.Process(
+            target=_decode_worker, args=(self.ring, self.requests, self.results, width, height)
+        )
+        self.workers = [
+            self._ctx.Process(target=_detect_worker, args=(self.ring, self.results, backend, counter_kwargs))
+            for _ in range(num_workers)
+        ]
+        for p in [self.decoder] + self.workers:
+            p.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check_alive(self) -> None:
+        processes = [("decoder", self.decoder)] + [(f"detector {i}", w) for i, w in enumerate(self.workers)]
+        for name, p in processes:
+            if not p.is_alive():
+                # a dead detector never gives its slot back, so nothing can be trusted to finish any more
+                self._failed = f"The {name} process exited with code {p.exitcode}"
+                raise RuntimeError(self._failed)
+
+    def count(self, video_path: str, indices: List[int]) -> List[int]:
+        """Number of faces in each of the frames `indices` (increasing) of `video_path`."""
+        if self._failed is not None:
+            raise RuntimeError(self._failed)
+        if not indices:
+            return []
+        self._scan_id += 1
+        self.requests.put((self._scan_id, video_path, list(indices)))
+        counts: Dict[int, List[int]] = {}
+        num_batches = None
+        while num_batches is None or len(counts) < num_batches:
+            try:
+                scan_id, kind, batch_no, payload = self.results.get(timeout=self.poll_interval)
+            except Empty:
+                self._check_alive()
+                continue
+            if scan_id != self._scan_id:
+                continue  # left over from a scan that failed
+            if kind == "error":
+                # whatever the decoder still sends for this scan is skipped by the next one
+                raise RuntimeError(f"Scanning {video_path} failed:\n{payload}")
+            if kind == "done":
+                num_batches = batch_no
+            else:
+                counts[batch_no] = payload
+        return [n for batch_no in sorted(counts) for n in counts[batch_no]]
+
+    def close(self) -> None:
+        # the decoder may still be filling slots for a scan that failed: the detectors keep consuming
+        # until it is done, then they are stopped
+        self.requests.put(None)
+        self._join(self.decoder)
+        for _ in self.workers:
+            self.ring.filled.put(None)
+        for w in self.workers:
+            self._join(w)
+        self.ring.close()
+        self.ring.unlink()
+
+    def _join(self, p) -> None:
+        p.join(timeout=None if self._failed is None else self.poll_interval)
+        if p.is_alive():
+            p.terminate()
+            p.join()
@@ -106,3 +106,7 @@ def download_lastest_chromedriver(current_chrome_version=""):
         )
 
     return result
+
+
+def get_video_id(url: str) -> str:
+    return re.findall(r"(?:v=|\/)([0-9A-Za-z_-]{11}).*", url)[0]
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+import os
+from typing import *
+
+import numpy as np
+
+
+def _paths(prefix: str) -> Tuple[str, str]:
+    return f"{prefix}.landmarks.npy", f"{prefix}.frames.npy"
+
+
+class LandmarkWriter:
+    """
+    Collects the face landmarks of one video as they are detected. Landmarks are streamed to a raw
+    temporary file and turned into two arrays on `close()`:
+    - `<prefix>.landmarks.npy`: int16 (total_faces, num_landmarks, 2), every face of every frame
+    - `<prefix>.frames.npy`: int64 (num_frames, 3) rows of (frame #, first face row, number of faces),
+      sorted by frame #
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._tmp_path = f"{prefix}.landmarks.tmp"
+        self._f = open(self._tmp_path, "wb")
+        self._index: List[Tuple[int, int, int]] = []
+        self._num_faces = 0
+        self._num_landmarks: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, frame_idx: int, faces: np.ndarray) -> None:
+        """:param faces: landmarks of the frame, shaped (num_faces, num_landmarks, 2)"""
+        if len(faces):
+            self._num_landmarks = faces.shape[1]
+            self._f.write(np.ascontiguousarray(faces, dtype=np.int16).tobytes())
+        self._index.append((frame_idx, self._num_faces, len(faces)))
+        self._num_faces += len(faces)
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self._f.close()
+        landmarks_path, frames_path = _paths(self.prefix)
+        shape = (self._num_faces, self._num_landmarks or 0, 2)
+        landmarks = np.lib.format.open_memmap(landmarks_path, mode="w+", dtype=np.int16, shape=shape)
+        if self._num_faces:
+            landmarks[:] = np.memmap(self._tmp_path, dtype=np.int16, mode="r", shape=shape)
+        landmarks.flush()
+        del landmarks
+        os.remove(self._tmp_path)
+        index = np.array(sorted(self._index), dtype=np.int64).reshape(-1, 3)
+        np.save(frames_path, index)
+
+
+class LandmarkStore:
+    """Read access to the landmarks saved by `LandmarkWriter`; the landmarks stay memory-mapped."""
+
+    def __init__(self, prefix: str):
+        landmarks_path, frames_path = _paths(prefix)
+        self.landmarks = np.load(landmarks_path, mmap_mode="r")
+        self.index = np.load(frames_path)
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return all(os.path.exists(path) for path in _paths(prefix))
+
+    @property
+    def frames(self) -> np.ndarray:
+        """Frame #s that have landmarks recorded (with or without faces)."""
+        return self.index[:, 0]
+
+    def get(self, frame_idx: int) -> Optional[np.ndarray]:
+        """Landmarks of `frame_idx` shaped (num_faces, num_landmarks, 2), or None if it was not scanned."""
+        i = np.searchsorted(self.index[:, 0], frame_idx)
+        if i == len(self.index) or self.index[i, 0] != frame_idx:
+            return None
+        _, start, count = self.index[i]
+        return self.landmarks[start : start + count]
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+import json
+import os
+import pickle
+import threading
+import time
+from typing import *
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class ManifestWriter:
+    """
+    Append-only JSONL manifest of per-video metadata records. Each record is written and flushed as
+    soon as it arrives; fsync is batched to every `fsync_every` records or `fsync_interval` seconds,
+    so a crash loses at most the last unsynced batch instead of the whole run.
+    """
+
+    def __init__(self, path: str, fsync_every=16, fsync_interval=5.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._f = open(path, "a")
+        if self._f.tell() > 0 and not _ends_with_newline(path):
+            self._f.write("\n")  # terminate a line torn by a crash so the next record starts clean
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _sync(self) -> None:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, url: str, record: Dict) -> None:
+        with self._lock:
+            self._f.write(json.dumps(dict(record, url=url)) + "\n")
+            self._f.flush()
+            self._unsynced += 1
+            overdue = time.monotonic() - self._last_sync >= self.fsync_interval
+            if self._unsynced >= self.fsync_every or overdue:
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._f.closed:
+                self._sync()
+                self._f.close()
+
+
+def iter_manifest(path: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yield `(url, record)` pairs one line at a time. A torn last line (crash mid-write) is skipped.
+    Legacy `.pkl` metadata files written by older runs are read too.
+    """
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            yield from pickle.load(f).items()
+        return
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            yield record.pop("url"), record
+
+
+def load_manifest(path: str) -> Dict[str, Dict]:
+    """Whole manifest as a dict; when a url was recorded more than once, the latest record wins."""
+    return dict(iter_manifest(path))
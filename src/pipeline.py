@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
+from typing import *
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a `Pipeline`: `fn(item)` returns the item handed to the next stage, or None to drop it.
+    With `use_processes`, `fn` runs in a pool of `num_workers` processes (it must be picklable),
+    otherwise on `num_workers` threads.
+    """
+
+    def __init__(self, name: str, fn: Callable, num_workers=1, queue_size=8, use_processes=False):
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+        self.num_processed = 0
+        self.num_failed = 0
+        self.busy_seconds = 0.0
+
+
+class Pipeline:
+    """
+    Streams items through a chain of stages connected by bounded queues, so every stage works as soon
+    as its first input is ready and a slow stage applies backpressure instead of piling up work.
+    Usage: `start()`, `put()` items, then `close()` and `join()`.
+    """
+
+    def __init__(
+        self, stages: List[Stage], on_error: Optional[Callable[[Stage, Any, Exception], None]] = None
+    ):
+        self.stages = stages
+        self.on_error = on_error
+        self.queues = [Queue(maxsize=stage.queue_size) for stage in stages]
+        # spawn, not fork: the parent is full of threads (downloads, other stages) when workers start
+        self._executors = [
+            ProcessPoolExecutor(stage.num_workers, mp_context=multiprocessing.get_context("spawn"))
+            if stage.use_processes
+            else None
+            for stage in stages
+        ]
+        self._alive = [stage.num_workers for stage in stages]
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def _worker(self, i: int) -> None:
+        stage, executor = self.stages[i], self._executors[i]
+        next_queue = self.queues[i + 1] if i + 1 < len(self.stages) else None
+        while True:
+            item = self.queues[i].get()
+            if item is _DONE:
+                self.queues[i].put(_DONE)  # let the sibling workers see it too
+                break
+            start = time.monotonic()
+            try:
+                if executor is not None:
+                    result = executor.submit(stage.fn, item).result()
+                else:
+                    result = stage.fn(item)
+                failed = False
+            except Exception as e:
+                result, failed = None, True
+                if self.on_error is not None:
+                    self.on_error(stage, item, e)
+            with self._lock:
+                stage.num_processed += not failed
+                stage.num_failed += failed
+                stage.busy_seconds += time.monotonic() - start
+            if result is not None and next_queue is not None:
+                next_queue.put(result)
+
+        with self._lock:
+            self._alive[i] -= 1
+            last = self._alive[i] == 0
+        if last and next_queue is not None:
+            next_queue.put(_DONE)
+
+    def start(self) -> None:
+        for i, stage in enumerate(self.stages):
+            for w in range(stage.num_workers):
+                t = threading.Thread(target=self._worker, args=(i,), name=f"{stage.name}-{w}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def put(self, item: Any) -> None:
+        """Feed an item to the first stage; blocks while that stage's queue is full."""
+        self.queues[0].put(item)
+
+    def close(self) -> None:
+        """No more input: stages finish what is queued and shut down in order."""
+        self.queues[0].put(_DONE)
+
+    def join(self) -> None:
+        for t in self._threads:
+            t.join()
+        for executor in self._executors:
+            if executor is not None:
+                executor.shutdown()
+
+    def report(self) -> str:
+        return "\n".join(
+            f"{stage.name}: {stage.num_processed} done, {stage.num_failed} failed, "
+            + f"{stage.busy_seconds:.1f}s busy over {stage.num_workers} workers"
+            for stage in self.stages
+        )
@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import *
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DownloadError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class RangedDownloader:
+    """
+    Downloads a file as fixed-size HTTP Range chunks over several pooled connections, writing each chunk
+    at its offset in a preallocated file. Finished chunks are recorded in a `<file>.progress.json` sidecar,
+    so an interrupted download resumes with only the missing chunks.
+    Every `download` gets its own session whose pool holds exactly its `num_connections` connections, so
+    concurrent downloads (each on its own CDN host) neither share nor evict each other's connections.
+    """
+
+    def __init__(
+        self,
+        num_connections=8,
+        chunk_size=8 * 1024 * 1024,
+        timeout=60.0,
+        max_retries=5,
+        rate_limiter=None,
+        on_throttle: Optional[Callable[[int], None]] = None,
+    ):
+        """
+        :param num_connections: Number of chunks fetched in parallel
+        :param chunk_size: Size of one Range request in bytes
+        :param timeout: Connect/read timeout of one request in seconds
+        :param max_retries: Attempts per chunk on connection errors and 5xx responses
+        :param rate_limiter: Object whose `consume(nbytes)` is called for every received block
+        :param on_throttle: Called with the status of every 429/5xx response
+        """
+        self.num_connections = num_connections
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self.on_throttle = on_throttle
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.num_connections)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @staticmethod
+    def progress_path(path: str) -> str:
+        return f"{path}.progress.json"
+
+    def is_complete(self, path: str, filesize: int) -> bool:
+        return (
+            os.path.exists(path)
+            and os.path.getsize(path) == filesize
+            and not os.path.exists(self.progress_path(path))
+        )
+
+    def _load_progress(self, path: str, filesize: int) -> Set[int]:
+        try:
+            with open(self.progress_path(path), "r") as f:
+                progress = json.load(f)
+            if progress["filesize"] == filesize and progress["chunk_size"] == self.chunk_size:
+                return set(progress["done"])
+        except (OSError, ValueError, KeyError):
+            pass
+        return set()
+
+    def _save_progress(self, path: str, filesize: int, done: Set[int]) -> None:
+        tmp_path = f"{self.progress_path(path)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"filesize": filesize, "chunk_size": self.chunk_size, "done": sorted(done)}, f)
+        os.replace(tmp_path, self.progress_path(path))
+
+    def _fetch_chunk(self, session: requests.Session, url: str, fd: int, start: int, end: int) -> int:
+        """Fetch bytes [start, end] into `fd` and return the number of bytes written."""
+        for attempt in range(self.max_retries):
+            try:
+                resp = session.get(
+                    url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=self.timeout
+                )
+                with resp:
+                    if self.on_throttle is not None and (resp.status_code == 429 or resp.status_code >= 500):
+                        self.on_throttle(resp.status_code)
+                    if resp.status_code != 206:
+                        raise DownloadError(
+                            f"HTTP {resp.status_code} for bytes {start}-{end}", resp.status_code
+                        )
+                    offset = start
+                    for block in resp.iter_content(1024 * 1024):
+                        offset += os.pwrite(fd, block, offset)
+                        if self.rate_limiter is not None:
+                            self.rate_limiter.consume(len(block))
+                if offset != end + 1:
+                    raise DownloadError(f"Short read for bytes {start}-{end}: got {offset - start} bytes")
+                return offset - start
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                DownloadError,
+            ) as e:
+                retryable = not isinstance(e, DownloadError) or e.status in (None, 429) or e.status >= 500
+                if not retryable or attempt == self.max_retries - 1:
+                    raise
+                time.sleep(min(2**attempt, 30))
+
+    def download(
+        self, url: str, path: str, filesize: int, on_progress: Optional[Callable[[int], None]] = None
+    ) -> None:
+        """
+        Download `url` into `path` (`filesize` bytes), resuming from the sidecar progress map if any.
+        :param on_progress: Called with the number of bytes of each finished chunk
+        :raises DownloadError: when a chunk fails for good (e.g. 403 once the stream url expired)
+        """
+        if self.is_complete(path, filesize):
+            return
+        num_chunks = math.ceil(filesize / self.chunk_size)
+        if os.path.exists(self.progress_path(path)):
+            done = self._load_progress(path, filesize)
+        elif os.path.exists(path) and os.path.getsize(path) < filesize:
+            # a partial file from a sequential downloader: every chunk below its size is valid
+            done = set(range(os.path.getsize(path) // self.chunk_size))
+        else:
+            done = set()
+        # write the sidecar before preallocating, so a full-size file without a sidecar is always complete
+        self._save_progress(path, filesize, done)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.truncate(filesize)
+
+        fd = os.open(path, os.O_RDWR)
+        session = self._new_session()
+        try:
+            with ThreadPoolExecutor(self.num_connections) as ex:
+                jobs = {}
+                for i in range(num_chunks):
+                    if i in done:
+                        continue
+                    start = i * self.chunk_size
+                    end = min(start + self.chunk_size, filesize) - 1
+                    jobs[ex.submit(self._fetch_chunk, session, url, fd, start, end)] = i
+                try:
+                    for job in as_completed(jobs):
+                        nbytes = job.result()
+                        done.add(jobs[job])
+                        self._save_progress(path, filesize, done)
+                        if on_progress is not None:
+                            on_progress(nbytes)
+                except BaseException:
+                    for job in jobs:
+                        job.cancel()
+                    raise
+            os.fsync(fd)
+        finally:
+            session.close()
+            os.close(fd)
+        os.remove(self.progress_path(path))
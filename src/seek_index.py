@@ -0,0 +1,199 @@
+#! /usr/bin/env python3
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from fractions import Fraction
+from typing import *
+
+import numpy as np
+
+
+def _probe_json(path: str, *args: str) -> Dict:
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", *args, "-of", "json", path],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode("utf-8"))
+
+
+def iter_ffmpeg_frames(
+    cmd: List[str], num_frames: int, width: int, height: int, batch_size: int
+) -> Iterator[np.ndarray]:
+    """
+    Run an ffmpeg command writing rgb24 rawvideo to stdout and yield `num_frames` frames as contiguous
+    uint8 batches shaped (N, height, width, 3). Each batch is read straight into a fresh buffer (consumers
+    may keep it, or pickle it to another process) and wrapped without copying.
+    Raises RuntimeError, with ffmpeg's error output, when ffmpeg stops before delivering all the frames.
+    """
+    frame_size = width * height * 3
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, bufsize=frame_size)
+        try:
+            delivered = 0
+            while delivered < num_frames:
+                buf = bytearray(min(batch_size, num_frames - delivered) * frame_size)
+                view, nread = memoryview(buf), 0
+                while nread < len(buf):
+                    got = proc.stdout.readinto(view[nread:])
+                    if not got:
+                        break
+                    nread += got
+                n = nread // frame_size
+                if n > 0:
+                    frames = np.frombuffer(buf, dtype=np.uint8, count=n * frame_size)
+                    yield frames.reshape(n, height, width, 3)
+                    delivered += n
+                if nread < len(buf):
+                    break
+            if delivered < num_frames:
+                returncode = proc.wait()
+                stderr.seek(0)
+                message = stderr.read().decode("utf-8", errors="replace").strip()
+                raise RuntimeError(
+                    f"ffmpeg delivered {delivered}/{num_frames} frames (exit code {returncode}): {message}"
+                )
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+
+
+class SeekIndex:
+    """
+    What readers need to know about a video without indexing the container again: frame count, fps,
+    frame size and the frame number and timestamp of every keyframe. Built once with a demux-only
+    ffprobe pass (no decoding) and saved as json, either next to the video (`<video>.seekindex.json`)
+    or in a central `index_dir`. A saved index is reused while the file's size and mtime are unchanged.
+    """
+
+    def __init__(self, video_path: str, index: Dict):
+        self.video_path = video_path
+        self.num_frames: int = index["num_frames"]
+        self.fps: float = index["fps"]
+        self.width: int = index["width"]
+        self.height: int = index["height"]
+        self.start_time: float = index["start_time"]
+        self.keyframes: List[int] = index["keyframes"]
+        self.keyframe_times: List[float] = index["keyframe_times"]
+
+    @staticmethod
+    def build(video_path: str) -> Dict:
+        stream = _probe_json(video_path, "-show_entries", "stream=width,height,avg_frame_rate,start_time")
+        stream = stream["streams"][0]
+        packets = _probe_json(video_path, "-show_entries", "packet=pts_time,flags")["packets"]
+        # packets come in decode order; presentation order (frame numbers) follows the timestamps
+        timed = sorted(
+            (float(p["pts_time"]), "K" in p.get("flags", ""))
+            for p in packets
+            if p.get("pts_time") not in (None, "N/A")
+        )
+        keyframes = [i for i, (_, is_key) in enumerate(timed) if is_key]
+        avg_frame_rate = stream.get("avg_frame_rate", "0/0")
+        return {
+            "num_frames": len(timed),
+            "fps": float(Fraction(avg_frame_rate)) if avg_frame_rate != "0/0" else 0.0,
+            "width": stream["width"],
+            "height": stream["height"],
+            "start_time": float(stream.get("start_time") or 0.0),
+            "keyframes": keyframes,
+            "keyframe_times": [timed[i][0] for i in keyframes],
+        }
+
+    @staticmethod
+    def index_path(video_path: str, index_dir: Optional[str] = None) -> str:
+        if index_dir is None:
+            return f"{video_path}.seekindex.json"
+        return f"{index_dir}/{hashlib.sha1(os.path.abspath(video_path).encode()).hexdigest()}.json"
+
+    @classmethod
+    def load(cls, video_path: str, index_dir: Optional[str] = None) -> "SeekIndex":
+        """The saved index of `video_path`, built (and saved) first if missing or stale."""
+        st = os.stat(video_path)
+        key = [st.st_size, st.st_mtime_ns]
+        path = cls.index_path(video_path, index_dir)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            if entry["key"] == key:
+                return cls(video_path, entry["index"])
+        except (OSError, ValueError, KeyError):
+            pass
+        entry = {"key": key, "index": cls.build(video_path)}
+        if index_dir is not None:
+            os.makedirs(index_dir, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(f"{path}.tmp", path)
+        return cls(video_path, entry["index"])
+
+    def keyframe_before(self, frame_idx: int) -> Tuple[int, float]:
+        """Frame number and timestamp of the last keyframe at or before `frame_idx`."""
+        i = max(0, bisect.bisect_right(self.keyframes, frame_idx) - 1)
+        return self.keyframes[i], self.keyframe_times[i]
+
+    def keyframe_after(self, frame_idx: int) -> int:
+        """Frame number of the first keyframe at or after `frame_idx` (`num_frames` past the last one)."""
+        i = bisect.bisect_left(self.keyframes, frame_idx)
+        return self.keyframes[i] if i < len(self.keyframes) else self.num_frames
+
+    def frame_at_keyframe_time(self, time: float) -> int:
+        """Frame number of the keyframe shown at `time` (e.g. where a seek landed or a segment starts)."""
+        i = bisect.bisect_left(self.keyframe_times, time)
+        # the nearest one: timestamps printed by ffmpeg tools are rounded
+        if i == len(self.keyframes) or (
+            i > 0 and time - self.keyframe_times[i - 1] < self.keyframe_times[i] - time
+        ):
+            i -= 1
+        return self.keyframes[max(i, 0)]
+
+    def read(
+        self,
+        start: int,
+        end: int,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        batch_size=64,
+    ) -> Iterator[np.ndarray]:
+        """
+        Frames [start, end) as RGB uint8 batches shaped (N, height, width, 3), scaled when a size is given.
+        ffmpeg seeks straight to the keyframe before `start` and decodes from there.
+        """
+        end = min(end, self.num_frames)
+        if start >= end:
+            return
+        width, height = width or self.width, height or self.height
+        keyframe, keyframe_time = self.keyframe_before(start)
+        # seek to half a frame past the keyframe: without accurate seeking ffmpeg starts at that keyframe
+        seek = keyframe_time - self.start_time + (0.5 / self.fps if self.fps else 0.0)
+        first, last = start - keyframe, end - keyframe - 1
+        vf = f"select=between(n\\,{first}\\,{last})"
+        if (width, height) != (self.width, self.height):
+            vf += f",scale={width}:{height}"
+        cmd = ["ffmpeg", "-v", "error", "-noaccurate_seek", "-ss", f"{max(seek, 0.0):.6f}"]
+        cmd += ["-i", self.video_path, "-an", "-sn", "-vf", vf, "-vsync", "0", "-frames:v", str(end - start)]
+        cmd += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+        yield from iter_ffmpeg_frames(cmd, end - start, width, height, batch_size)
+
+
+_indexes: Dict[Tuple[str, Optional[str]], Tuple[Tuple[int, int], SeekIndex]] = {}
+_lock = threading.Lock()
+
+
+def get_seek_index(video_path: str, index_dir: Optional[str] = None) -> SeekIndex:
+    """`SeekIndex.load`, memoized per process while the file is unchanged."""
+    key = (os.path.abspath(video_path), index_dir)
+    st = os.stat(video_path)
+    stat = (st.st_size, st.st_mtime_ns)
+    with _lock:
+        cached = _indexes.get(key)
+    if cached is not None and cached[0] == stat:
+        return cached[1]
+    index = SeekIndex.load(video_path, index_dir)
+    with _lock:
+        _indexes[key] = (stat, index)
+    return index
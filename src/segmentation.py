@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+import time
+from typing import *
+
+import numpy as np
+
+
+def find_runs(values: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Run-length encoding: the value, start and (exclusive) end index of every run of equal values."""
+    values = np.asarray(values)
+    if len(values) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return values, empty, empty
+    change = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(values)]))
+    return values[starts], starts, ends
+
+
+def fill_gaps(
+    mask: np.ndarray,
+    max_gap: int,
+    face_markers: Optional[Sequence[int]] = None,
+    gap_counts: Collection[int] = (0,),
+) -> np.ndarray:
+    """
+    Set runs of at most `max_gap` False samples to True when they have True runs on both sides and
+    (given the `face_markers`) each of their samples has one of the `gap_counts` face counts.
+    """
+    if max_gap <= 0 or len(mask) == 0:
+        return mask
+    values, starts, ends = find_runs(mask)
+    gaps = ~values & (ends - starts <= max_gap)
+    gaps[0] = gaps[-1] = False  # a gap at either end of the video is not enclosed
+    if face_markers is not None and gaps.any():
+        # only the short gaps are looked at, sample by sample
+        gap_starts, gap_lens = starts[gaps], ends[gaps] - starts[gaps]
+        offsets = np.arange(gap_lens.sum()) - np.repeat(np.cumsum(gap_lens) - gap_lens, gap_lens)
+        samples = np.asarray(face_markers)[np.repeat(gap_starts, gap_lens) + offsets]
+        others = np.add.reduceat(~np.isin(samples, list(gap_counts)), np.cumsum(gap_lens) - gap_lens)
+        gaps[gaps] = others == 0
+    return np.repeat(values | gaps, ends - starts)
+
+
+def eligible_runs(
+    face_markers: Sequence[int], num_faces=1, min_len=10, max_gap=0, gap_counts: Collection[int] = (0,)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Start and (exclusive) end sample of every run of `num_faces` faces lasting at least `min_len` samples,
+    after tolerating dropouts of up to `max_gap` samples inside a run. Only samples with one of the
+    `gap_counts` face counts (by default missed detections) count as a dropout: a short shot with
+    another number of faces still ends the run. A run reaching the end of the markers is included.
+    """
+    face_markers = np.asarray(face_markers)
+    mask = fill_gaps(face_markers == num_faces, max_gap, face_markers, gap_counts)
+    values, starts, ends = find_runs(mask)
+    keep = values & (ends - starts >= min_len)
+    return starts[keep], ends[keep]
+
+
+def chunk_runs(starts: np.ndarray, ends: np.ndarray, max_len: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Split every [start, end) into consecutive pieces of `max_len`; the last piece of a run is shorter."""
+    starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+    counts = -(-(ends - starts) // max_len)
+    run = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    chunk_starts = starts[run] + offsets * max_len
+    return chunk_starts, np.minimum(chunk_starts + max_len, ends[run])
+
+
+def segment(
+    face_markers: Sequence[int],
+    fps: int,
+    num_faces=1,
+    min_sec_per_seq=10,
+    max_gap_sec=0,
+    max_frames_per_clip=700,
+    num_frames: Optional[int] = None,
+    gap_counts: Collection[int] = (0,),
+) -> List[Tuple[int, int]]:
+    """
+    Clips of continuous `num_faces` faces, as (start frame #, end frame #) pairs with an exclusive end.
+    `face_markers` holds one face count per second, sample i being frame i * fps. A run ends where the
+    first sample with another count is, and no clip goes past its run (or `num_frames`). Up to
+    `max_gap_sec` samples with one of the `gap_counts` face counts are bridged, see `eligible_runs`.
+    """
+    starts, ends = eligible_runs(face_markers, num_faces, min_sec_per_seq, max_gap_sec, gap_counts)
+    start_frames, end_frames = starts * fps, ends * fps
+    if num_frames is not None:
+        end_frames = np.minimum(end_frames, num_frames)
+    clip_starts, clip_ends = chunk_runs(start_frames, end_frames, max_frames_per_clip)
+    return list(zip(clip_starts.tolist(), clip_ends.tolist()))
+
+
+def benchmark(num_samples=1_000_000, fps=30, seed=0) -> float:
+    """Segment `num_samples` synthetic markers (1-120s shots, 1% dropouts); returns the seconds taken."""
+    rng = np.random.default_rng(seed)
+    shot_lengths = rng.integers(1, 120, size=num_samples // 30)
+    face_markers = np.repeat(rng.integers(0, 3, size=len(shot_lengths)), shot_lengths)[:num_samples]
+    dropouts = rng.random(len(face_markers)) < 0.01
+    face_markers[dropouts] = 0
+    start = time.perf_counter()
+    clips = segment(face_markers, fps, max_gap_sec=1)
+    elapsed = time.perf_counter() - start
+    print(f"{len(face_markers)} samples -> {len(clips)} clips in {elapsed * 1000:.1f}ms")
+    return elapsed
+
+
+if __name__ == "__main__":
+    benchmark()
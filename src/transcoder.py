@@ -0,0 +1,219 @@
+#! /usr/bin/env python3
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+from functools import lru_cache
+from typing import *
+
+copyable_video_codecs = {"h264"}
+copyable_pix_fmts = {"yuv420p", "yuvj420p"}
+copyable_audio_codecs = {"aac", "mp3"}
+
+
+def ffprobe(path: str) -> Dict:
+    result = subprocess.run(
+        shlex.split(f'ffprobe -v error -show_streams -show_format -of json "{path}"'),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode("utf-8"))
+
+
+class ProbeCache:
+    """ffprobe results per file, kept in memory and (optionally) as json files in `cache_dir`.
+    An entry is reused while the file's size and mtime are unchanged."""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self._mem: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, path: str) -> str:
+        return f"{self.cache_dir}/{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()}.json"
+
+    def get(self, path: str) -> Dict:
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._mem.get(path)
+        if entry is None and self.cache_dir is not None and os.path.exists(self._entry_path(path)):
+            with open(self._entry_path(path), "r") as f:
+                entry = json.load(f)
+        if entry is not None and tuple(entry["key"]) == key:
+            return entry["probe"]
+
+        entry = {"key": key, "probe": ffprobe(path)}
+        with self._lock:
+            self._mem[path] = entry
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._entry_path(path), "w") as f:
+                json.dump(entry, f)
+        return entry["probe"]
+
+
+def first_stream(probe: Dict, codec_type: str) -> Optional[Dict]:
+    return next((s for s in probe.get("streams", []) if s.get("codec_type") == codec_type), None)
+
+
+def duration_of(probe: Dict) -> float:
+    return float(probe.get("format", {}).get("duration") or 0.0)
+
+
+@lru_cache(maxsize=None)
+def nvenc_available() -> bool:
+    """True when ffmpeg has h264_nvenc *and* a GPU can actually open an encoding session."""
+    if shutil.which("ffmpeg") is None or shutil.which("nvidia-smi") is None:
+        return False
+    encoders = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    if b"h264_nvenc" not in encoders.stdout:
+        return False
+    test = subprocess.run(
+        shlex.split("ffmpeg -v error -f lavfi -i color=size=256x256:duration=0.1 -c:v h264_nvenc -f null -"),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return test.returncode == 0
+
+
+@lru_cache(maxsize=None)
+def num_gpus() -> int:
+    if shutil.which("nvidia-smi") is None:
+        return 0
+    result = subprocess.run(["nvidia-smi", "-L"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return len([l for l in result.stdout.decode("utf-8").splitlines() if l.startswith("GPU")])
+
+
+def x264_preset(threads: int) -> str:
+    """Faster presets when a job only gets a few cores, so CPU-only workers keep up with downloads."""
+    if threads <= 2:
+        return "veryfast"
+    if threads <= 4:
+        return "faster"
+    if threads <= 8:
+        return "fast"
+    return "medium"
+
+
+class Transcoder:
+    """
+    Converts videos to mp4/h264. Each stream is handled on its own:
+    - video is stream-copied when it is already h264 4:2:0, otherwise encoded with h264_nvenc if a GPU
+      is usable or libx264 with a preset sized to the cores each job gets
+    - audio is stream-copied when mp4 compatible, otherwise encoded to aac
+    When nothing needs encoding the file is just remuxed (`-c copy`). Outputs are probed and checked
+    against the source before they replace any existing file.
+    """
+
+    def __init__(
+        self,
+        probe_cache_dir: Optional[str] = None,
+        encoder: Optional[str] = None,
+        num_workers: Optional[int] = None,
+        video_bitrate="6500k",
+        audio_bitrate="960k",
+        duration_tolerance=1.0,
+    ):
+        """
+        :param probe_cache_dir: Where probe results are kept between runs (memory only when None)
+        :param encoder: "h264_nvenc" or "libx264"; detected from the hardware when None
+        :param num_workers: Concurrent jobs; sized to the hardware when None
+        :param duration_tolerance: Allowed difference in seconds between source and output duration
+        """
+        self.probes = ProbeCache(probe_cache_dir)
+        self._encoder = encoder
+        self._num_workers = num_workers
+        self.video_bitrate = video_bitrate
+        self.audio_bitrate = audio_bitrate
+        self.duration_tolerance = duration_tolerance
+
+    @property
+    def encoder(self) -> str:
+        if self._encoder is None:
+            self._encoder = "h264_nvenc" if nvenc_available() else "libx264"
+        return self._encoder
+
+    @property
+    def num_workers(self) -> int:
+        if self._num_workers is None:
+            if self.encoder == "h264_nvenc":
+                # consumer cards cap concurrent nvenc sessions, two per gpu keeps them busy
+                self._num_workers = max(1, 2 * num_gpus())
+            else:
+                self._num_workers = max(1, (os.cpu_count() or 1) // 4)
+        return self._num_workers
+
+    @property
+    def threads_per_job(self) -> int:
+        return max(1, (os.cpu_count() or 1) // self.num_workers)
+
+    def plan(self, probe: Dict) -> Dict[str, Optional[str]]:
+        """Returns "copy" or "encode" for the video and audio stream (None when there is no audio)."""
+        video, audio = first_stream(probe, "video"), first_stream(probe, "audio")
+        if video is None:
+            raise ValueError("No video stream")
+        video_ok = (
+            video.get("codec_name") in copyable_video_codecs and video.get("pix_fmt") in copyable_pix_fmts
+        )
+        audio_ok = audio is not None and audio.get("codec_name") in copyable_audio_codecs
+        return {
+            "video": "copy" if video_ok else "encode",
+            "audio": None if audio is None else ("copy" if audio_ok else "encode"),
+        }
+
+    def command(self, src: str, dst: str, plan: Dict[str, Optional[str]]) -> List[str]:
+        cmd = ["ffmpeg", "-y", "-loglevel", "error", "-stats"]
+        if plan["video"] == "encode" and self.encoder == "h264_nvenc":
+            cmd += ["-hwaccel", "cuda", "-hwaccel_device", "0"]
+        cmd += ["-i", src]
+        if plan["video"] == "copy":
+            cmd += ["-c:v", "copy"]
+        elif self.encoder == "h264_nvenc":
+            cmd += ["-c:v", "h264_nvenc", "-b:v", self.video_bitrate, "-vf", "format=yuv420p"]
+        else:
+            threads = self.threads_per_job
+            cmd += ["-c:v", "libx264", "-preset", x264_preset(threads), "-threads", str(threads)]
+            cmd += ["-b:v", self.video_bitrate, "-vf", "format=yuv420p"]
+        if plan["audio"] == "copy":
+            cmd += ["-c:a", "copy"]
+        elif plan["audio"] == "encode":
+            cmd += ["-c:a", "aac", "-b:a", self.audio_bitrate]
+        return cmd + ["-movflags", "+faststart", "-f", "mp4", dst]
+
+    def verify(self, src_probe: Dict, dst: str, use_cache=True) -> bool:
+        if not os.path.exists(dst) or os.path.getsize(dst) == 0:
+            return False
+        try:
+            dst_probe = self.probes.get(dst) if use_cache else ffprobe(dst)
+        except subprocess.CalledProcessError:
+            return False
+        video = first_stream(dst_probe, "video")
+        if video is None or video.get("codec_name") != "h264":
+            return False
+        if (first_stream(src_probe, "audio") is None) != (first_stream(dst_probe, "audio") is None):
+            return False
+        return abs(duration_of(src_probe) - duration_of(dst_probe)) <= self.duration_tolerance
+
+    def transcode(self, src: str, dst: str) -> Tuple[bool, Dict[str, Optional[str]]]:
+        """
+        Convert `src` into `dst`, skipping the work when `dst` is already a verified conversion of `src`.
+        Returns whether `dst` is valid and the per-stream plan that was used.
+        """
+        src_probe = self.probes.get(src)
+        plan = self.plan(src_probe)
+        if self.verify(src_probe, dst):
+            return True, plan
+        tmp_dst = f"{dst}.part"
+        subprocess.run(self.command(src, tmp_dst, plan), stdout=subprocess.PIPE)
+        if not self.verify(src_probe, tmp_dst, use_cache=False):
+            if os.path.exists(tmp_dst):
+                os.remove(tmp_dst)
+            return False, plan
+        os.replace(tmp_dst, dst)
+        return True, plan
@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import *
+
+from pytube import YouTube
+
+from helper import get_video_id
+
+schema = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    title TEXT,
+    author TEXT,
+    description TEXT,
+    length INTEGER,
+    streams TEXT,
+    fetched_at REAL
+)
+"""
+
+
+def select_streams(record: Dict, file_extension="mp4", res="1080p") -> List[Dict]:
+    """Same selection as `yt.streams.filter(file_extension=..., res=...)`, on a cached stream manifest."""
+    return [s for s in record["streams"] if s["subtype"] == file_extension and s["resolution"] == res]
+
+
+class VideoMetadataCache:
+    """
+    On-disk (sqlite) cache of the pytube metadata of a video, keyed by video id: title, author,
+    description, length and the stream manifest, with file sizes for the streams we download.
+    Stream urls expire on youtube's side, so a record is only served for stream lookups while it is
+    younger than `stream_ttl` seconds; title/author/description are served regardless of age.
+    Safe to share between threads and forked processes (each gets its own connection).
+    """
+
+    def __init__(self, db_path: str, stream_ttl=5 * 3600, sized_streams=(("mp4", "1080p"),)):
+        """
+        :param db_path: Path to the sqlite database, created on first use
+        :param stream_ttl: Seconds a cached stream manifest stays valid
+        :param sized_streams: (file_extension, res) pairs whose file sizes are fetched and cached
+        """
+        self.db_path = db_path
+        self.stream_ttl = stream_ttl
+        self.sized_streams = set(sized_streams)
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local, self._pid = threading.local(), os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(schema)
+            self._local.conn = conn
+        return conn
+
+    def _stream_record(self, stream) -> Dict:
+        sized = (stream.subtype, stream.resolution) in self.sized_streams
+        return {
+            "itag": stream.itag,
+            "url": stream.url,
+            "mime_type": stream.mime_type,
+            "subtype": stream.subtype,
+            "resolution": stream.resolution,
+            "is_progressive": stream.is_progressive,
+            "filesize": stream.filesize if sized else None,
+        }
+
+    def _load(self, video_id: str) -> Optional[Dict]:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT video_id, title, author, description, length, streams, fetched_at "
+                + "FROM videos WHERE video_id = ?",
+                (video_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        keys = ("video_id", "title", "author", "description", "length", "streams", "fetched_at")
+        record = dict(zip(keys, row))
+        record["streams"] = json.loads(record["streams"])
+        return record
+
+    def _store(self, record: Dict) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record["video_id"],
+                    record["title"],
+                    record["author"],
+                    record["description"],
+                    record["length"],
+                    json.dumps(record["streams"]),
+                    record["fetched_at"],
+                ),
+            )
+
+    def fetch(self, url: str, **yt_kwargs) -> Tuple[Dict, YouTube]:
+        """Fetch the metadata from the network, refresh the cache and return the record and pytube object."""
+        yt = YouTube(url, **yt_kwargs)
+        record = {
+            "video_id": yt.video_id,
+            "title": yt.title,
+            "author": yt.author,
+            "description": yt.description,
+            "length": yt.length,
+            "streams": [self._stream_record(s) for s in yt.streams],
+            "fetched_at": time.time(),
+        }
+        self._store(record)
+        return record, yt
+
+    def get(self, url: str, need_streams=True) -> Dict:
+        """
+        Read-through lookup. With `need_streams`, a record whose stream manifest is older than
+        `stream_ttl` is fetched again; otherwise any cached record is returned.
+        """
+        record = self._load(get_video_id(url))
+        if record is not None and (not need_streams or time.time() - record["fetched_at"] < self.stream_ttl):
+            return record
+        return self.fetch(url)[0]
+
+    def invalidate(self, url: Optional[str] = None) -> None:
+        """Drop the record of `url`, or every record when `url` is None."""
+        with self._conn() as conn:
+            if url is None:
+                conn.execute("DELETE FROM videos")
+            else:
+                conn.execute("DELETE FROM videos WHERE video_id = ?", (get_video_id(url),))
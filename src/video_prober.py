@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+import asyncio
+from typing import *
+
+from helper import get_video_id
+
+
+class VideoProber:
+    """
+    Runs a blocking eligibility check (e.g. a pytube stream lookup) on candidate videos concurrently,
+    at most `max_concurrency` at a time. Every video id is checked at most once, no matter how often
+    the same candidate is submitted.
+    """
+
+    def __init__(
+        self,
+        check: Callable[[str], bool],
+        max_concurrency=8,
+        on_error: Optional[Callable[[str, Exception], None]] = None,
+    ):
+        """
+        :param check: Blocking function returning True when the video url should be accepted
+        :param max_concurrency: Maximum number of checks running at the same time
+        :param on_error: Called with the url and the exception when a check raises
+        """
+        self.check = check
+        self.max_concurrency = max_concurrency
+        self.on_error = on_error
+        self.seen: Set[str] = set()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def num_pending(self) -> int:
+        return sum(not t.done() for t in self._tasks)
+
+    @property
+    def has_work(self) -> bool:
+        """True while some submitted check has not been drained yet."""
+        return len(self._tasks) > 0
+
+    def submit(self, video_url: str) -> bool:
+        """Schedule a check for `video_url`. Returns False if its video id was already submitted."""
+        try:
+            video_id = get_video_id(video_url)
+        except IndexError:
+            return False
+        if video_id in self.seen:
+            return False
+        self.seen.add(video_id)
+        self._tasks.add(asyncio.create_task(self._probe(video_url)))
+        return True
+
+    async def _probe(self, video_url: str) -> Tuple[str, bool]:
+        async with self._semaphore:
+            try:
+                return video_url, await asyncio.to_thread(self.check, video_url)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(video_url, e)
+                return video_url, False
+
+    async def drain(self, wait=False) -> List[str]:
+        """
+        Collect the urls accepted by the checks finished so far.
+        With `wait`, first block until at least one pending check finishes.
+        """
+        if wait and self._tasks and not any(t.done() for t in self._tasks):
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+        done = {t for t in self._tasks if t.done()}
+        self._tasks -= done
+        return [video_url for video_url, ok in (t.result() for t in done) if ok]
+
+    async def close(self) -> None:
+        """Cancel checks that are no longer needed."""
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
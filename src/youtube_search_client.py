@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+import json
+import re
+from typing import *
+
+import requests
+from requests.adapters import HTTPAdapter
+
+default_headers = {
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+        + "Chrome/110.0.0.0 Safari/537.36"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+}
+initial_data_markers = ("var ytInitialData = ", 'window["ytInitialData"] = ', "ytInitialData = ")
+ytcfg_marker = "ytcfg.set("
+
+
+def parse_duration(duration_text: Optional[str]) -> Optional[int]:
+    """Convert a `H:MM:SS` / `M:SS` length text into seconds. Returns None for live streams or bad input."""
+    if not duration_text or not re.fullmatch(r"\d+(:\d{1,2})*", duration_text.strip()):
+        return None
+    seconds = 0
+    for part in duration_text.strip().split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def find_key(obj: Any, key: str) -> Iterator[Any]:
+    """Yield every value stored under `key` anywhere inside a nested json object."""
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == key:
+                yield v
+            yield from find_key(v, key)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from find_key(v, key)
+
+
+def extract_json_after(html: str, marker: str) -> Optional[Any]:
+    start = html.find(marker)
+    if start < 0:
+        return None
+    start = html.find("{", start + len(marker))
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(html, start)
+        return obj
+    except ValueError:
+        return None
+
+
+def extract_initial_data(html: str) -> Dict:
+    for marker in initial_data_markers:
+        data = extract_json_after(html, marker)
+        if data is not None:
+            return data
+    raise ValueError("Could not find ytInitialData in the result page")
+
+
+def extract_ytcfg(html: str) -> Dict:
+    ytcfg, pos = {}, html.find(ytcfg_marker)
+    while pos >= 0:
+        cfg = extract_json_after(html[pos:], ytcfg_marker)
+        if isinstance(cfg, dict):
+            ytcfg.update(cfg)
+        pos = html.find(ytcfg_marker, pos + len(ytcfg_marker))
+    return ytcfg
+
+
+def parse_videos(data: Any) -> List[Dict]:
+    videos = []
+    for renderer in find_key(data, "videoRenderer"):
+        if not isinstance(renderer, dict) or "videoId" not in renderer:
+            continue
+        title = renderer.get("title", {})
+        title = title.get("simpleText") or "".join(r.get("text", "") for r in title.get("runs", []))
+        duration_text = renderer.get("lengthText", {}).get("simpleText")
+        videos.append(
+            {
+                "video_id": renderer["videoId"],
+                "title": title,
+                "duration_text": duration_text,
+                "duration": parse_duration(duration_text),
+            }
+        )
+    return videos
+
+
+def parse_continuation(data: Any) -> Optional[str]:
+    for command in find_key(data, "continuationCommand"):
+        if isinstance(command, dict) and command.get("token"):
+            return command["token"]
+    return None
+
+
+class YouTubeSearchClient:
+    """
+    Browserless YouTube search. Fetches the result page and its continuation pages over a pooled
+    HTTP session and reads the videos from the embedded `ytInitialData` json.
+    `base_url` can point to a local stand-in server (see `youtube_search_replay_server.py`).
+    """
+
+    def __init__(self, base_url="https://www.youtube.com", pool_size=8, timeout=10.0, max_retries=3):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(default_headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def video_url(self, video_id: str) -> str:
+        return f"https://www.youtube.com/watch?v={video_id}"
+
+    def fetch_results_page(self, search_string: str) -> Tuple[List[Dict], Optional[str], Dict]:
+        """Returns the videos of the first result page, the continuation token and the page's ytcfg."""
+        resp = self.session.get(
+            f"{self.base_url}/results", params={"search_query": search_string}, timeout=self.timeout
+        )
+        resp.raise_for_status()
+        data = extract_initial_data(resp.text)
+        return parse_videos(data), parse_continuation(data), extract_ytcfg(resp.text)
+
+    def fetch_continuation(self, token: str, ytcfg: Dict) -> Tuple[List[Dict], Optional[str]]:
+        resp = self.session.post(
+            f"{self.base_url}/youtubei/v1/search",
+            params={"key": ytcfg.get("INNERTUBE_API_KEY", ""), "prettyPrint": "false"},
+            json={"context": ytcfg.get("INNERTUBE_CONTEXT", {}), "continuation": token},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        return parse_videos(data), parse_continuation(data)
+
+    def search(self, search_string: str, max_pages=10) -> Iterator[Dict]:
+        """Yield result videos page by page (without duplicates) until the results or `max_pages` run out."""
+        seen = set()
+        videos, token, ytcfg = self.fetch_results_page(search_string)
+        for page in range(max_pages):
+            for video in videos:
+                if video["video_id"] not in seen:
+                    seen.add(video["video_id"])
+                    yield dict(video, url=self.video_url(video["video_id"]))
+            if token is None or page == max_pages - 1:
+                break
+            videos, token = self.fetch_continuation(token, ytcfg)
+
+    def close(self) -> None:
+        self.session.close()
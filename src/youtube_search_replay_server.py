@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+"""
+Local stand-in for YouTube's search endpoints, used to exercise `YouTubeSearchClient` offline.
+
+Recordings layout:
+    <recordings_dir>/results.html                   first result page served for any query
+    <recordings_dir>/results_<query slug>.html      first result page for one specific query
+    <recordings_dir>/continuations/<sha1>.json      continuation response, keyed by sha1 of the token
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+from urllib.parse import parse_qs, urlparse
+
+from youtube_search_client import YouTubeSearchClient, extract_initial_data, extract_ytcfg, parse_continuation
+
+
+def query_slug(search_string: str) -> str:
+    return re.sub(r"[^0-9a-z]+", "_", search_string.lower()).strip("_")
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()
+
+
+def record(search_string: str, recordings_dir: str, max_pages=3) -> None:
+    """Save the live result page and its continuations for `search_string` into `recordings_dir`."""
+    os.makedirs(f"{recordings_dir}/continuations", exist_ok=True)
+    client = YouTubeSearchClient()
+    resp = client.session.get(
+        f"{client.base_url}/results", params={"search_query": search_string}, timeout=client.timeout
+    )
+    resp.raise_for_status()
+    with open(f"{recordings_dir}/results_{query_slug(search_string)}.html", "w") as f:
+        f.write(resp.text)
+
+    data = extract_initial_data(resp.text)
+    token, ytcfg = parse_continuation(data), extract_ytcfg(resp.text)
+    for _ in range(max_pages - 1):
+        if token is None:
+            break
+        resp = client.session.post(
+            f"{client.base_url}/youtubei/v1/search",
+            params={"key": ytcfg.get("INNERTUBE_API_KEY", ""), "prettyPrint": "false"},
+            json={"context": ytcfg.get("INNERTUBE_CONTEXT", {}), "continuation": token},
+            timeout=client.timeout,
+        )
+        resp.raise_for_status()
+        with open(f"{recordings_dir}/continuations/{token_key(token)}.json", "w") as f:
+            f.write(resp.text)
+        token = parse_continuation(resp.json())
+    client.close()
+
+
+def make_handler(recordings_dir: str) -> Type[BaseHTTPRequestHandler]:
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def _send(self, path: str, content_type: str):
+            if not os.path.exists(path):
+                self.send_error(404, f"No recording at {path}")
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            if parsed.path != "/results":
+                self.send_error(404)
+                return
+            search_string = parse_qs(parsed.query).get("search_query", [""])[0]
+            path = f"{recordings_dir}/results_{query_slug(search_string)}.html"
+            if not os.path.exists(path):
+                path = f"{recordings_dir}/results.html"
+            self._send(path, "text/html; charset=utf-8")
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/youtubei/v1/search":
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            path = f"{recordings_dir}/continuations/{token_key(body.get('continuation', ''))}.json"
+            self._send(path, "application/json")
+
+        def log_message(self, *args):
+            pass
+
+    return ReplayHandler
+
+
+def serve(recordings_dir: str, host="127.0.0.1", port=0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the replay server on a background thread. Returns the server and its base url."""
+    server = ThreadingHTTPServer((host, port), make_handler(recordings_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    server, base_url = serve(sys.argv[1] if len(sys.argv) > 1 else "recordings")
+    client = YouTubeSearchClient(base_url=base_url)
+    for video in client.search(sys.argv[2] if len(sys.argv) > 2 else "jamie foxx interview"):
+        print(video)
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
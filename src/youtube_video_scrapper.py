@@ -1,29 +1,28 @@
 import asyncio
 import os
-import pickle
-import shlex
-import shutil
 import subprocess
-from multiprocessing import Manager, Pool
 from typing import *
+from urllib.parse import urlparse
 
 import rich
-from pytube import YouTube
 from pytube.exceptions import PytubeError
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 from tqdm.auto import tqdm
 
+from async_chrome_driver_manager import AsyncChromeDriverManager
 from chrome_driver_manager import ChromeDriverManager
-from helper import get_all_files
-
-
-async def check_if_page_loaded(driver, prev_url):
-    while driver.current_url == prev_url:
-        pass
+from chrome_driver_pool import ChromeDriverPool
+from download_scheduler import DownloadScheduler, is_throttle_status
+from metadata_manifest import ManifestWriter
+from pipeline import Pipeline, Stage
+from ranged_downloader import DownloadError, RangedDownloader
+from transcoder import Transcoder
+from video_metadata_cache import VideoMetadataCache, select_streams
+from video_prober import VideoProber
+from youtube_search_client import YouTubeSearchClient
 
 
 open_proc = lambda cmd_list: subprocess.Popen(
@@ -32,7 +31,20 @@ open_proc = lambda cmd_list: subprocess.Popen(
 
 url = "https://www.youtube.com"
 max_num_videos = 12
-max_num_proc = 10
+max_download_concurrency = 10
+initial_download_concurrency = 4
+max_downloads_per_host = 4
+max_download_bytes_per_sec = None  # e.g. 50 * 1024 * 1024 to leave room on the link
+num_transcode_workers = None  # sized to the encoder hardware by the transcoder
+num_face_scan_workers = 2
+pipeline_queue_size = 8
+num_search_drivers = 4
+max_searches_per_driver = 5
+search_backend = "http"  # "http" parses the result page json, "selenium" drives chrome
+max_search_pages = 10
+max_probe_concurrency = 8
+max_idle_scrolls = 5
+excluded_title_words = ["amber", "heard", "johnny", "depp", "live", "trial"]
 search_bar_xpath = "//input[@id='search']"
 filter_btn_xpath = "//button[@aria-label='Search filters']"
 thumbnail_xpath = """
@@ -44,38 +56,90 @@ dataset_root_dir = "/media/nas2/Tai/4-deepfake-data"
 download_dir = f"{dataset_root_dir}/downloads_batch_2"
 h264_cvt_dir = f"{dataset_root_dir}/h264_batch_2"
 download_list_txt = f"{dataset_root_dir}/download_list_batch_2.txt"
-metadata_file = f"{dataset_root_dir}/metadata_batch_2.pkl"
+metadata_file = f"{dataset_root_dir}/metadata_batch_2.jsonl"
+downloader = RangedDownloader(num_connections=8, chunk_size=8 * 1024 * 1024)
+transcoder = Transcoder(probe_cache_dir=f"{dataset_root_dir}/probe_cache")
+metadata_cache = VideoMetadataCache(f"{dataset_root_dir}/video_metadata_cache.sqlite")
 console = rich.get_console()
 
 
-async def get_video_urls(search_string) -> Set:
+def has_excluded_title(video_title: str) -> bool:
+    video_title = video_title.lower()
+    return any(s in video_title for s in excluded_title_words)
+
+
+def on_probe_error(video_url: str, e: Exception):
+    console.print(f"[bold red][ERROR]:[/bold red][red]\t\t{video_url}: {e}")
+
+
+def is_eligible_video(video_url: str) -> bool:
+    record = metadata_cache.get(video_url)
+    video_streams = select_streams(record, file_extension="mp4", res="1080p")
+    if len(video_streams) < 1:
+        return False
+    return not has_excluded_title(record["title"])
+
+
+async def get_video_urls_http(search_string, client: YouTubeSearchClient) -> List:
+    video_urls = set()
+    console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\tSearching {search_string} over http..")
+    results = client.search(search_string, max_pages=max_search_pages)
+    prober = VideoProber(is_eligible_video, max_concurrency=max_probe_concurrency, on_error=on_probe_error)
+    pbar = tqdm(total=None, desc=search_string)
+    exhausted = False
+    try:
+        while len(video_urls) < max_num_videos:
+            while not exhausted and prober.num_pending < max_probe_concurrency:
+                video = await asyncio.to_thread(next, results, None)
+                if video is None:
+                    exhausted = True
+                elif not has_excluded_title(video["title"]):
+                    prober.submit(video["url"])
+            if not prober.has_work:
+                break
+            for video_url in await prober.drain(wait=True):
+                if len(video_urls) < max_num_videos:
+                    video_urls.add(video_url)
+                    pbar.set_description(f"Processing {len(video_urls)}/{max_num_videos}")
+                    pbar.update()
+    except Exception as e:
+        console.print(f"[bold red][ERROR]:[/bold red][red]\t\tHttp search failed with {repr(e)}")
+    await prober.close()
+    pbar.close()
+    return list(video_urls)
+
+
+async def get_video_urls(search_string, cdm: Optional[ChromeDriverManager] = None) -> Set:
     video_urls = set()
-    console.print("[bold blue][INFO ]:[/bold blue][blue]\t\tSetting up the chrome headless driver..")
-    cdm = ChromeDriverManager(headless=True, driver_version="110")
+    owns_driver = cdm is None
+    if owns_driver:
+        console.print("[bold blue][INFO ]:[/bold blue][blue]\t\tSetting up the chrome headless driver..")
+        acdm = await AsyncChromeDriverManager.create(headless=True, driver_version="110")
+    else:
+        acdm = AsyncChromeDriverManager(cdm)
+    prober, pbar = None, None
     try:
         console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\tOpening {url}..")
-        cdm.open_url(url)
+        await acdm.open_url(url)
 
         try:
-            element_present = EC.presence_of_element_located((By.XPATH, search_bar_xpath))
-            WebDriverWait(cdm.driver, 5.0).until(element_present)
+            await acdm.wait_until(EC.presence_of_element_located((By.XPATH, search_bar_xpath)), timeout=5.0)
         except TimeoutException:
             console.print(
                 "[bold red][ERROR]:[/bold red][red]\t\tTimed out waiting for page to load search bar"
             )
 
         console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\tInput search string: {search_string}..")
-        search_bar = cdm.driver.find_element(By.XPATH, search_bar_xpath)
-        search_bar.send_keys(search_string)
+        search_bar = await acdm.find_element(By.XPATH, search_bar_xpath)
+        await acdm.send_keys(search_bar, search_string)
         await asyncio.sleep(2)
-        search_bar.send_keys(Keys.RETURN)
+        await acdm.send_keys(search_bar, Keys.RETURN)
 
         console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\tWaiting for search results to appear..")
-        await asyncio.wait_for(check_if_page_loaded(cdm.driver, url), timeout=20.0)
+        await acdm.wait_for_url_change(url, timeout=20.0)
 
         try:
-            element_present = EC.presence_of_element_located((By.XPATH, filter_btn_xpath))
-            WebDriverWait(cdm.driver, 5.0).until(element_present)
+            await acdm.wait_until(EC.presence_of_element_located((By.XPATH, filter_btn_xpath)), timeout=5.0)
         except TimeoutException:
             console.print(
                 "[bold red][ERROR]:[/bold red][red]\t\tTimed out waiting for page to load filter button"
@@ -83,148 +147,154 @@ async def get_video_urls(search_string) -> Set:
 
         console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\tProcessing result page..")
         last_thumbnail_loc = 0
-        pbar = tqdm(total=None)
-        while len(video_urls) < max_num_videos:
-            thumbnails = cdm.driver.find_elements(By.XPATH, thumbnail_xpath)
-            if thumbnails[-1].location["y"] > last_thumbnail_loc:
-                # print(len(video_urls), last_thumbnail_loc, thumbnails[-1].location["y"])
-                for t in thumbnails:
-                    video_url: str = t.get_attribute("href")
+        num_seen_thumbnails = 0
+        num_idle_scrolls = 0
+        prober = VideoProber(
+            is_eligible_video, max_concurrency=max_probe_concurrency, on_error=on_probe_error
+        )
+        pbar = tqdm(total=None, desc=search_string)
+        while len(video_urls) < max_num_videos and num_idle_scrolls < max_idle_scrolls:
+            thumbnails = await acdm.find_elements(By.XPATH, thumbnail_xpath)
+            thumbnail_loc = (await acdm.location(thumbnails[-1]))["y"] if thumbnails else 0
+            if thumbnail_loc > last_thumbnail_loc:
+                # thumbnails keep their order while scrolling, so only the new ones need a look
+                for t in thumbnails[num_seen_thumbnails:]:
+                    video_url: str = await acdm.get_attribute(t, "href")
                     if video_url.find("list") < 0 and video_url.startswith("https://www.youtube.com"):
-                        try:
-                            yt_obj = YouTube(video_url)
-                            video_title = yt_obj.title.lower()
-                            video_streams = mp4files = yt_obj.streams.filter(
-                                file_extension="mp4", res="1080p"
-                            )
-                            if len(video_streams) < 1:
-                                continue
-                            if any(
-                                list(
-                                    map(
-                                        lambda s: s in video_title,
-                                        ["amber", "heard", "johnny", "depp", "live", "trial"],
-                                    )
-                                )
-                            ):
-                                continue
-                            video_urls.add(video_url)
-                            pbar.set_description(f"Processing {len(video_urls)}/{max_num_videos}")
-                            pbar.update()
-                        except Exception as e:
-                            console.print(f"[bold red][ERROR]:[/bold red][red]\t\t{e}")
-                            continue
-                last_thumbnail_loc = thumbnails[-1].location["y"]
-
-            cdm.driver.execute_script(f"window.scrollBy(0, 1000)", "")
+                        prober.submit(video_url)
+                num_seen_thumbnails = len(thumbnails)
+                last_thumbnail_loc = thumbnail_loc
+                num_idle_scrolls = 0
+            elif prober.num_pending == 0:
+                num_idle_scrolls += 1
+
+            for video_url in await prober.drain():
+                if len(video_urls) < max_num_videos:
+                    video_urls.add(video_url)
+                    pbar.set_description(f"Processing {len(video_urls)}/{max_num_videos}")
+                    pbar.update()
+
+            await acdm.execute_script(f"window.scrollBy(0, 1000)", "")
             await asyncio.sleep(2.0)  # wait for page to load
-        pbar.close()
-
-        cdm.close_driver()
+    except WebDriverException as e:
+        # page-level errors (a missing or re-rendered element, a timeout) keep the results found so far;
+        # a crashed browser is handed back to the pool, which replaces it, and the caller retries
+        crashed = isinstance(e, InvalidSessionIdException) or not await asyncio.to_thread(acdm.cdm.is_alive)
+        if crashed and not owns_driver:
+            raise
+        console.print(f"[bold red][ERROR]:[/bold red][red]\t\t{e}")
     except Exception as e:
         console.print(f"[bold red][ERROR]:[/bold red][red]\t\t{e}")
-        if cdm.driver.session_id:
-            cdm.close_driver()
     finally:
-        return list(video_urls)
+        if prober is not None:
+            await prober.close()
+        if pbar is not None:
+            pbar.close()
+        await acdm.close(quit_driver=owns_driver and acdm.cdm.driver.session_id is not None)
+    return list(video_urls)
 
 
 def on_complete_download(_, file_path: str):
     console.print(f"[bold green][FINISHED]:[/bold green][green]\t\tFinished downloading {file_path}")
 
 
-def download_video(url: str, search_string: str, metadata):
+def download_video(url: str, search_string: str) -> Optional[Dict]:
+    """Download the 1080p mp4 stream of `url`. Returns its metadata record once the file is complete."""
     try:
-        yt = YouTube(url, on_complete_callback=on_complete_download)
-        mp4files = yt.streams.filter(file_extension="mp4", res="1080p")
+        record = metadata_cache.get(url, need_streams=False)
+        mp4files = select_streams(record, file_extension="mp4", res="1080p")
         if len(mp4files) > 0:
-            yt_stream = mp4files[-1]
-            default_path = f"{download_dir}/{yt.video_id}.mp4"
-            filesize_in_stream = yt_stream.filesize
+            video_id, title = record["video_id"], record["title"]
+            default_path = f"{download_dir}/{video_id}.mp4"
+            filesize_in_stream = mp4files[-1]["filesize"]
             filesize_on_disk = os.path.getsize(default_path) if os.path.exists(default_path) else -1
-            metadata[url] = {
+            video_metadata = {
                 "search_string": search_string,
-                "title": yt.title,
-                "author": yt.author,
-                "desc": yt.description,
+                "title": title,
+                "author": record["author"],
+                "desc": record["description"],
                 "size": filesize_in_stream,
                 "path": default_path,
             }
             console.print(
-                f"[bold blue][INFO ]:[/bold blue][blue]\t\t{yt.title}, {filesize_in_stream}, "
+                f"[bold blue][INFO ]:[/bold blue][blue]\t\t{title}, {filesize_in_stream}, "
                 + f"{filesize_on_disk}, {filesize_in_stream == filesize_on_disk}"
             )
-            if filesize_in_stream != filesize_on_disk:
+            if not downloader.is_complete(default_path, filesize_in_stream):
                 console.print(
-                    f"[bold blue][INFO ]:[/bold blue][blue]\t\tDownloading...{yt.title} ({yt.video_id}.mp4)"
-                )
-                yt_stream.download(
-                    output_path=download_dir,
-                    filename=f"{yt.video_id}.mp4",
-                    max_retries=100,
-                    timeout=300,
+                    f"[bold blue][INFO ]:[/bold blue][blue]\t\tDownloading...{title} ({video_id}.mp4)"
                 )
+                os.makedirs(download_dir, exist_ok=True)
+                yt_stream = select_streams(metadata_cache.get(url), file_extension="mp4", res="1080p")[-1]
+                try:
+                    downloader.download(yt_stream["url"], default_path, yt_stream["filesize"])
+                except DownloadError as e:
+                    if e.status != 403:
+                        raise
+                    # the cached stream url has expired, resume the missing chunks from a fresh one
+                    record, _ = metadata_cache.fetch(url)
+                    yt_stream = select_streams(record, file_extension="mp4", res="1080p")[-1]
+                    downloader.download(yt_stream["url"], default_path, yt_stream["filesize"])
+                on_complete_download(None, default_path)
             else:
                 console.print(
-                    f"[bold blue][INFO ]:[/bold blue][blue]\t\t{yt.title} has already been downloaded."
+                    f"[bold blue][INFO ]:[/bold blue][blue]\t\t{title} has already been downloaded."
                 )
+            return video_metadata
         else:
             console.print(
                 f"[bold red][ERROR]:[/bold red][red]\t\tNo 1080p resolution or mp4 stream doesn't exist "
-                + f"for {yt.title} {yt.video_id}"
+                + f"for {record['title']} {record['video_id']}"
             )
+    except DownloadError as e:
+        if is_throttle_status(e.status):
+            raise  # let the scheduler back off and retry
+        console.print(f"[bold red][ERROR]:[/bold red][red]\t\t{url} has failed with {repr(e)}")
     except (Exception, PytubeError) as e:
-        console.print(
-            f"[bold red][ERROR]:[/bold red][red]\t\tFile {yt.title} ({yt.video_id}.mp4) "
-            + f"has failed with {repr(e)}"
-        )
+        console.print(f"[bold red][ERROR]:[/bold red][red]\t\t{url} has failed with {repr(e)}")
+
+
+def stream_host(url: str) -> str:
+    """Host serving the 1080p mp4 stream of `url` according to the metadata cache."""
+    try:
+        record = metadata_cache.get(url, need_streams=False)
+        return urlparse(select_streams(record, file_extension="mp4", res="1080p")[-1]["url"]).netloc
+    except Exception:
+        return urlparse(url).netloc
 
 
-def re_encode_as_h264(path: str):
+def re_encode_as_h264(path: str) -> Optional[str]:
     dir, fname = os.path.split(path)
     basename, ext = os.path.splitext(fname)
     new_file_path = f"{h264_cvt_dir}/{basename}.mp4"
 
-    get_codec = subprocess.run(
-        shlex.split(
-            f"ffprobe -v error -select_streams v:0 "
-            + f"-show_entries stream=codec_name -of default=noprint_wrappers=1:nokey=1 "
-            + f'"{path}"'
-        ),
-        stdout=subprocess.PIPE,
-    )
-    codec_name = str(get_codec.stdout.decode("utf-8")).strip()
-    if codec_name != "h264":
+    console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\tConverting {path} -> {new_file_path}(h264)...")
+    ok, plan = transcoder.transcode(path, new_file_path)
+    if not ok:
         console.print(
-            f"[bold blue][INFO ]:[/bold blue][blue]\t\tConverting {path}({codec_name}) "
-            + f"-> {new_file_path}(h264)..."
-        )
-        subprocess.run(
-            shlex.split(
-                f"ffmpeg -loglevel error -stats "
-                + "-hwaccel cuda "
-                + "-hwaccel_device 0 "
-                + f'-i "{path}" '
-                + "-c:v h264_nvenc "
-                + "-b:v 6500k "
-                # + "-preset fast "
-                + "-c:a aac "
-                + "-b:a 960k "
-                + "-vf format=yuv420p "
-                + "-movflags +faststart "
-                + f'"{new_file_path}"'
-            ),
-            stdout=subprocess.PIPE,
+            f"\n\n[bold red][ERROR]:[/bold red][red]\t\tConversion of {path} ({plan}) failed verification! "
+            + f"Discarded the unverified output {new_file_path}.part"
         )
-        new_size = os.path.getsize(new_file_path)
-        if new_size == 0:
-            console.print(
-                f"\n\n[bold red][ERROR]:[/bold red][red]\t\tNew file's size is 0! "
-                + f"Delete h264 version {new_file_path}"
-            )
-            os.remove(new_file_path)
-    else:
-        shutil.copy(path, new_file_path)
+        return None
+    console.print(
+        f"[bold blue][INFO ]:[/bold blue][blue]\t\t{new_file_path} ready "
+        + f"(video {plan['video']}, audio {plan['audio']})"
+    )
+    return new_file_path
+
+
+def transcode_stage(item: Tuple[str, Dict]) -> Optional[Tuple[str, Dict]]:
+    url, video_metadata = item
+    new_file_path = re_encode_as_h264(video_metadata["path"])
+    return None if new_file_path is None else (url, dict(video_metadata, path=new_file_path))
+
+
+def face_scan_stage(item: Tuple[str, Dict]) -> int:
+    # imported here: it loads torch, decord, mediapipe, cv2 and av, which importers of this module's
+    # settings (e.g. the annotation extraction workers) don't need
+    import eligible_clip_extractor
+
+    return eligible_clip_extractor.process_video(*item)
 
 
 async def main():
@@ -266,41 +336,112 @@ async def main():
     ]
     print("\n".join(search_strings))
 
+    search_client = YouTubeSearchClient()
+
+    async def harvest(ss: str) -> List[str]:
+        if search_backend == "http":
+            extracted_urls = await get_video_urls_http(f"{ss} interview", search_client)
+            if len(extracted_urls) > 0:
+                return extracted_urls
+            console.print(
+                f"[bold yellow][WARN ]:[/bold yellow][yellow]\t\tHttp search found nothing for {ss}, "
+                + "falling back to chrome.."
+            )
+        for attempt in range(pool.max_retries + 1):
+            try:
+                async with pool.alease() as cdm:
+                    return await get_video_urls(f"{ss} interview", cdm)
+            except WebDriverException as e:
+                if attempt == pool.max_retries:
+                    console.print(
+                        f"[bold red][ERROR]:[/bold red][red]\t\tSearching {ss} failed with {repr(e)}"
+                    )
+                    return []
+                console.print(
+                    f"[bold yellow][WARN ]:[/bold yellow][yellow]\t\tBrowser crashed searching {ss}, "
+                    + "retrying on a fresh one.."
+                )
+
+    with ChromeDriverPool(
+        width=num_search_drivers, max_uses=max_searches_per_driver, headless=True, driver_version="110"
+    ) as pool:
+        if search_backend == "selenium":
+            console.print(
+                f"[bold blue][INFO ]:[/bold blue][blue]\t\tStarting {num_search_drivers} "
+                + "chrome headless drivers.."
+            )
+            await asyncio.to_thread(pool.start)
+        all_extracted_urls = await asyncio.gather(*[harvest(ss) for ss in search_strings])
+    search_client.close()
+
     video_urls = []
-    for ss in search_strings:
-        extracted_urls = await get_video_urls(f"{ss} interview")
+    for ss, extracted_urls in zip(search_strings, all_extracted_urls):
         video_urls += list(zip(extracted_urls, [ss] * len(extracted_urls)))
 
     with open(download_list_txt, "w") as f:
         for i, (url, search_string) in enumerate(video_urls):
-            f.write(f"{i+1}, {url}, {search_string}, {YouTube(url).title}\n")
+            title = metadata_cache.get(url, need_streams=False)["title"]
+            f.write(f"{i+1}, {url}, {search_string}, {title}\n")
 
     with open(download_list_txt, "r") as f:
         for line in f:
             fields = line.split(", ")
             video_urls.append((fields[1], fields[2]))
 
-    multiproc_manager = Manager()
-    metadata = multiproc_manager.dict()
-
-    with Pool(max_num_proc) as p:
-        jobs = []
-        for url, search_string in video_urls:
-            job = p.apply_async(download_video, (url, search_string, metadata))
-            jobs.append(job)
-
-        # collect results from the workers through the pool result queue
-        for job in jobs:
-            job.get()
-
-    with open(metadata_file, "wb") as f:
-        pickle.dump(dict(metadata), f)
+    video_urls = list(dict.fromkeys(video_urls))
 
     if not os.path.exists(h264_cvt_dir):
         os.makedirs(h264_cvt_dir)
-    downloaded_files = get_all_files(download_dir, suffix=".mp4")
-    with Pool(2) as p:
-        p.map(re_encode_as_h264, downloaded_files)
+    # each finished download goes straight to transcoding, and each transcoded file to face scanning
+    pipeline = Pipeline(
+        [
+            Stage(
+                "transcode",
+                transcode_stage,
+                num_workers=num_transcode_workers or transcoder.num_workers,
+                queue_size=pipeline_queue_size,
+            ),
+            Stage(
+                "face-scan",
+                face_scan_stage,
+                num_workers=num_face_scan_workers,
+                queue_size=pipeline_queue_size,
+                use_processes=True,
+            ),
+        ],
+        on_error=lambda stage, item, e: console.print(
+            f"[bold red][ERROR]:[/bold red][red]\t\t{stage.name} of {item[0]} has failed with {repr(e)}"
+        ),
+    )
+    pipeline.start()
+    manifest = ManifestWriter(metadata_file)
+
+    def on_downloaded(args: Tuple, video_metadata: Optional[Dict]):
+        if video_metadata is not None:
+            manifest.append(args[0], video_metadata)
+            pipeline.put((args[0], video_metadata))
+
+    scheduler = DownloadScheduler(
+        download_video,
+        max_concurrency=max_download_concurrency,
+        initial_concurrency=initial_download_concurrency,
+        bytes_per_sec=max_download_bytes_per_sec,
+        per_host_limit=max_downloads_per_host,
+        on_result=on_downloaded,
+        on_error=lambda args, e: console.print(
+            f"[bold red][ERROR]:[/bold red][red]\t\t{args[0]} has failed with {repr(e)}"
+        ),
+    )
+    # every chunk of every download draws from the scheduler's budget and reports throttling to it
+    downloader.rate_limiter = scheduler.bandwidth
+    downloader.on_throttle = scheduler.controller.on_throttle
+    for url, search_string in video_urls:
+        scheduler.submit(url, search_string, group=search_string, host=stream_host(url))
+    scheduler.run()
+    manifest.close()
+    pipeline.close()
+    pipeline.join()
+    console.print(f"[bold blue][INFO ]:[/bold blue][blue]\t\t{pipeline.report()}")
 
 
 if __name__ == "__main__":